@@ -5,6 +5,76 @@
 
 import pandas as pd
 import numpy as np
+try:
+    from numba import njit, prange
+except ImportError:
+    # Без numba ядра ниже работают как обычные Python-функции
+    prange = range
+
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+
+# Наклон меньше этого по модулю считается горизонтальной линией
+HORIZONTAL_SLOPE = 0.001
+
+
+@njit(cache=True)
+def parallel_check(t1_idx, t1_price, t3_idx, t3_price, t2_idx, t2_price, t4_idx, t4_price, tolerance):
+    """
+    Проверка параллельности линий 1-3 и 2-4 - единое правило для ParallelEntryStrategy,
+    batch_parallel_check и визуализации.
+    
+    Две горизонтальные линии (|slope| < HORIZONTAL_SLOPE) параллельны (relative_diff = 0),
+    горизонтальная и наклонная - нет (relative_diff = inf); иначе линии параллельны, если
+    относительное отклонение наклонов не больше tolerance (0.01 = 1%).
+    
+    Returns:
+        tuple: (slope_1_3, slope_2_4, relative_diff, is_parallel)
+    """
+    slope_1_3 = (t3_price - t1_price) / (t3_idx - t1_idx) if t3_idx != t1_idx else 0.0
+    slope_2_4 = (t4_price - t2_price) / (t4_idx - t2_idx) if t4_idx != t2_idx else 0.0
+    horizontal_1_3 = abs(slope_1_3) < HORIZONTAL_SLOPE
+    horizontal_2_4 = abs(slope_2_4) < HORIZONTAL_SLOPE
+    if horizontal_1_3 and horizontal_2_4:
+        return slope_1_3, slope_2_4, 0.0, True
+    if horizontal_1_3 or horizontal_2_4:
+        return slope_1_3, slope_2_4, np.inf, False
+    avg_slope = (abs(slope_1_3) + abs(slope_2_4)) / 2
+    relative_diff = abs(slope_1_3 - slope_2_4) / avg_slope
+    return slope_1_3, slope_2_4, relative_diff, relative_diff <= tolerance
+
+
+@njit(parallel=True, cache=True)
+def batch_parallel_check(idxs, prices, tolerance):
+    """
+    parallel_check для пачки паттернов (например, по всем тикерам сканера).
+    
+    Args:
+        idxs: Массив (N, 4) индексов точек T1, T2, T3, T4
+        prices: Массив (N, 4) цен тех же точек (из DataFrame - через .to_numpy())
+        tolerance: Допустимое относительное отклонение наклонов
+        
+    Returns:
+        tuple: Массивы slope_1_3, slope_2_4, relative_diff и is_parallel длины N
+    """
+    n = idxs.shape[0]
+    slopes_1_3 = np.empty(n)
+    slopes_2_4 = np.empty(n)
+    relative_diffs = np.empty(n)
+    is_parallel = np.empty(n, dtype=np.bool_)
+    for i in prange(n):
+        slope_1_3, slope_2_4, relative_diff, parallel = parallel_check(
+            idxs[i, 0], prices[i, 0], idxs[i, 2], prices[i, 2],
+            idxs[i, 1], prices[i, 1], idxs[i, 3], prices[i, 3], tolerance
+        )
+        slopes_1_3[i] = slope_1_3
+        slopes_2_4[i] = slope_2_4
+        relative_diffs[i] = relative_diff
+        is_parallel[i] = parallel
+    return slopes_1_3, slopes_2_4, relative_diffs, is_parallel
 
 
 class ParallelEntryStrategy:
@@ -50,35 +120,19 @@ class ParallelEntryStrategy:
         t4_idx = t4['idx']
         t4_price = t4['price']
         
-        # Вычисляем slope (изменение цены на единицу индекса)
-        if t3_idx == t1_idx:
-            slope_1_3 = 0
-        else:
-            slope_1_3 = (t3_price - t1_price) / (t3_idx - t1_idx)
-        
-        if t4_idx == t2_idx:
-            slope_2_4 = 0
-        else:
-            slope_2_4 = (t4_price - t2_price) / (t4_idx - t2_idx)
-        
-        # Проверяем параллельность: сравниваем абсолютные значения slopes
-        # Если оба slope равны нулю или очень близки к нулю - считаем параллельными
-        if abs(slope_1_3) < 0.001 and abs(slope_2_4) < 0.001:
-            return True, slope_1_3, slope_2_4, "Линии горизонтальны (оба slope ≈ 0)"
-        
-        # Если один из slopes равен нулю, а другой нет - не параллельны
-        if abs(slope_1_3) < 0.001 or abs(slope_2_4) < 0.001:
-            return False, slope_1_3, slope_2_4, "Одна линия горизонтальна, другая нет"
-        
-        # Вычисляем относительное отклонение
-        avg_slope = (abs(slope_1_3) + abs(slope_2_4)) / 2
-        diff = abs(slope_1_3 - slope_2_4)
-        relative_diff = diff / avg_slope if avg_slope != 0 else float('inf')
-        
-        # Проверяем, что отклонение в пределах допустимого
-        is_parallel = relative_diff <= self.tolerance_percent
+        # Наклоны и параллельность - общим правилом parallel_check
+        slope_1_3, slope_2_4, relative_diff, is_parallel = parallel_check(
+            t1_idx, t1_price, t3_idx, t3_price, t2_idx, t2_price, t4_idx, t4_price, self.tolerance_percent
+        )
         
-        if is_parallel:
+        # Описание результата (горизонтальные линии parallel_check разбирает отдельно)
+        horizontal_1_3 = abs(slope_1_3) < HORIZONTAL_SLOPE
+        horizontal_2_4 = abs(slope_2_4) < HORIZONTAL_SLOPE
+        if horizontal_1_3 and horizontal_2_4:
+            desc = "Линии горизонтальны (оба slope ≈ 0)"
+        elif horizontal_1_3 or horizontal_2_4:
+            desc = "Одна линия горизонтальна, другая нет"
+        elif is_parallel:
             desc = f"Линии параллельны (отклонение {relative_diff*100:.2f}% <= {self.tolerance_percent*100:.0f}%)"
         else:
             desc = f"Линии не параллельны (отклонение {relative_diff*100:.2f}% > {self.tolerance_percent*100:.0f}%)"
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Тестирование общего правила параллельности линий 1-3 и 2-4 (parallel_check):
+пакетная версия и ParallelEntryStrategy должны давать те же ответы.
+Брокерский SDK не нужен - импортируется только trading_bot.parallel_entry_strategy.
+
+Запуск: python trading_bot/test_parallel_check.py или python -m pytest --rootdir=trading_bot
+trading_bot/test_parallel_check.py (корневой __init__.py импортирует сканеры, а с ними t_tech)
+"""
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# Добавляем путь к модулям
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from trading_bot.parallel_entry_strategy import ParallelEntryStrategy, parallel_check, batch_parallel_check
+
+
+def _make_patterns(n_patterns, seed=42):
+    """
+    Случайные паттерны (индексы и цены T1, T2, T3, T4): наклоны от обычных до почти
+    горизонтальных (|slope| < 0.001), плюс вырожденные случаи
+    """
+    rng = np.random.default_rng(seed)
+    idxs = np.sort(rng.integers(0, 100, (n_patterns, 4)), axis=1)
+    # Масштаб наклона по строкам: обычный, около порога горизонтальности, почти ноль
+    scale = np.array([1.0, 0.001, 0.00001])[np.arange(n_patterns) % 3]
+    prices = 100 + rng.uniform(-1, 1, (n_patterns, 4)) * scale[:, None] * idxs
+    # T1 и T3 на одной свече (slope 1-3 = 0)
+    idxs[0] = [10, 20, 10, 30]
+    # Обе линии горизонтальны
+    prices[1] = 100.0
+    # Оба наклона меньше порога: 0.0005 и 0.0009
+    idxs[2] = [0, 5, 10, 15]
+    prices[2] = [100.0, 99.0, 100.005, 99.009]
+    # Одна линия горизонтальна, другая нет
+    idxs[3] = [0, 5, 10, 15]
+    prices[3] = [100.0, 99.0, 100.0, 100.0]
+    return idxs, prices
+
+
+def test_batch_parallel_check_matches_scalar():
+    """batch_parallel_check совпадает с parallel_check по каждому паттерну"""
+    print("=" * 70)
+    print("🧪 ПАКЕТНАЯ ПРОВЕРКА ПАРАЛЛЕЛЬНОСТИ == ПОШТУЧНАЯ")
+    print("=" * 70)
+
+    idxs, prices = _make_patterns(600)
+    tolerance = 0.1
+    batch = batch_parallel_check(idxs, prices, tolerance)
+    scalar = [
+        parallel_check(t1_idx, t1_price, t3_idx, t3_price, t2_idx, t2_price, t4_idx, t4_price, tolerance)
+        for (t1_idx, t2_idx, t3_idx, t4_idx), (t1_price, t2_price, t3_price, t4_price) in zip(idxs, prices)
+    ]
+    for column, expected in zip(batch, zip(*scalar)):
+        np.testing.assert_allclose(column, np.array(expected, dtype=column.dtype))
+
+    print(f"   ✅ {len(idxs)} паттернов: результаты совпадают (параллельны: {int(batch[3].sum())})")
+    print()
+
+
+def test_batch_parallel_check_matches_strategy():
+    """batch_parallel_check совпадает с ParallelEntryStrategy.check_lines_parallel (решения бота)"""
+    print("=" * 70)
+    print("🧪 ПАКЕТНАЯ ПРОВЕРКА ПАРАЛЛЕЛЬНОСТИ == ParallelEntryStrategy")
+    print("=" * 70)
+
+    idxs, prices = _make_patterns(600)
+    for tolerance in (0.01, 0.1):
+        strategy = ParallelEntryStrategy(tolerance_percent=tolerance)
+        slopes_1_3, slopes_2_4, _, is_parallel = batch_parallel_check(idxs, prices, tolerance)
+        for i, (pattern_idxs, pattern_prices) in enumerate(zip(idxs, prices)):
+            pattern = {
+                f't{k + 1}': {'idx': int(pattern_idxs[k]), 'price': float(pattern_prices[k])}
+                for k in range(4)
+            }
+            expected, slope_1_3, slope_2_4, desc = strategy.check_lines_parallel(pattern)
+            assert bool(is_parallel[i]) == expected, f"паттерн {i}, tolerance={tolerance}: {desc}"
+            np.testing.assert_allclose([slopes_1_3[i], slopes_2_4[i]], [slope_1_3, slope_2_4])
+        print(f"   ✅ tolerance={tolerance}: {len(idxs)} паттернов совпадают "
+              f"(параллельны: {int(is_parallel.sum())})")
+
+    # Оба наклона меньше порога горизонтальности - линии параллельны
+    _, _, _, horizontal = batch_parallel_check(idxs[2:3], prices[2:3], 0.1)
+    assert horizontal[0]
+    print()
+
+
+if __name__ == "__main__":
+    test_batch_parallel_check_matches_scalar()
+    test_batch_parallel_check_matches_strategy()
@@ -109,17 +109,22 @@ class TradeManager:
                 return {} if is_dict else []
         return {} if is_dict else []
 
+    def _save_json_atomic(self, path, data):
+        """Пишет JSON во временный файл и атомарно подменяет path (дашборд не увидит недописанный файл)"""
+        tmp_path = path.with_suffix(path.suffix + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=4, default=str)
+        os.replace(tmp_path, path)
+
     def _save_active_trades(self):
-        with open(self.trades_file, 'w') as f:
-            json.dump(self.active_trades, f, indent=4, default=str)
+        self._save_json_atomic(self.trades_file, self.active_trades)
 
     def reload_active_trades_from_file(self):
         """Перезагружает active_trades из файла (учёт закрытий из дашборда)."""
         self.active_trades = self._load_json(self.trades_file, is_dict=True)
 
     def _save_history(self):
-        with open(self.history_file, 'w') as f:
-            json.dump(self.closed_trades, f, indent=4, default=str)
+        self._save_json_atomic(self.history_file, self.closed_trades)
 
     def _money_value_to_float(self, mv):
         """Конвертирует MoneyValue (units, nano) в float. Для цены исполнения заявки."""
@@ -633,11 +638,15 @@ class TradeManager:
         Принудительно закрывает все активные позиции.
         Args:
             current_prices: Словарь {ticker: {'price': float, 'time': str}}
+        Returns:
+            Словарь активных сделок после закрытия (в том виде, в каком он сохранен в файл):
+            в нем остаются только позиции, которые закрыть не удалось
         """
         self._log(f"\n🚨 ПРИНУДИТЕЛЬНОЕ ЗАКРЫТИЕ ВСЕХ ПОЗИЦИЙ ({len(self.active_trades)})")
         
         # Создаем список тикеров для закрытия, чтобы не менять словарь во время итерации
         tickers_to_close = list(self.active_trades.keys())
+        failed_trades = {}
         
         for ticker in tickers_to_close:
             trade = self.active_trades[ticker]
@@ -662,12 +671,17 @@ class TradeManager:
                  self._log(f"⚠️ Цена закрытия все еще 0 для {ticker}, P&L будет некорректным", 'warning')
             
             # Закрываем позицию
-            self._close_position(ticker, trade, exit_price, "MANUAL CLOSE ALL", exit_time)
+            try:
+                self._close_position(ticker, trade, exit_price, "MANUAL CLOSE ALL", exit_time)
+            except Exception as e:
+                self._log(f"❌ Не удалось закрыть позицию {ticker}: {e}", 'error')
+                failed_trades[ticker] = trade
         
-        # Очищаем список активных сделок
-        self.active_trades = {}
+        # В активных остаются только позиции, которые закрыть не удалось
+        self.active_trades = failed_trades
         self._save_active_trades()
         self.print_statistics()
+        return self.active_trades
 
     def print_statistics(self):
         """Выводит сводную статистику"""
@@ -1,20 +1,30 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import json
+import re
 from pathlib import Path
 from datetime import datetime, timedelta
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 import os
 import sys
+import time
+import asyncio
+from functools import lru_cache
 from dotenv import load_dotenv
-from t_tech.invest import Client, CandleInterval, InstrumentIdType
-from t_tech.invest.utils import quotation_to_decimal
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Plotly и t_tech.invest импортируются при первом использовании (см. _lazy_plotly и функции
+# работы с API): холодный старт дашборда не платит за их загрузку, пока они не нужны.
+# По той же причине config (он импортирует t_tech.invest) читается только в timeframe_settings.
 
 # Добавляем путь к корню проекта для импорта модулей
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+from trading_bot.pattern_tracker import PatternTracker
+
 load_dotenv()
 
 # Настройки страницы
@@ -35,22 +45,152 @@ DATA_DIR_PATH = os.environ.get("DATA_DIR", "trading_bot")
 BASE_DIR = Path(DATA_DIR_PATH)
 TRADES_ACTIVE = BASE_DIR / "trades_active.json"
 TRADES_HISTORY = BASE_DIR / "trades_history.json"
+# Датасет для ML: TradeManager дописывает его построчно (append) при каждом закрытии сделки,
+# поэтому формат остается CSV (Parquet не поддерживает дозапись). Дашборд его не читает.
 ML_DATASET = BASE_DIR / "training_data" / "dataset_v1.csv"
 
+# Минимальный интервал (сек) между перезаписями trades_active.json при очистке закрытых позиций
+ACTIVE_CLEANUP_INTERVAL = 60
+
+# Строковые колонки истории с малым числом различных значений (хранятся как category)
+HISTORY_CATEGORY_COLUMNS = ('ticker', 'direction', 'close_reason', 'strategy_desc', 'entry_mode', 'timeframe')
+
+# Сколько закрытых сделок показывать в списке выбора для визуализации (одна страница)
+HISTORY_PAGE_SIZE = 200
+
+# Сколько секунд цена закрытия из стакана считается актуальной (см. fetch_close_price)
+PRICE_CACHE_TTL = 3.0
+
+# Колонки снэпшота свечей, которые нужны графику сделки (остальные индикаторы не читаются)
+SNAPSHOT_COLUMNS = ('time', 'open', 'high', 'low', 'close', 'volume', 'ema_7', 'ema_14')
+SNAPSHOT_DTYPES = {col: 'float64' for col in SNAPSHOT_COLUMNS if col != 'time'}
+
+# Больше свечей на график активной позиции не отправляем: браузер рисует их заметно медленнее,
+# поэтому длинные ряды прореживаются (см. downsample_chart_data)
+MAX_CHART_CANDLES = 2000
+
+# Стиль маркера текущей цены на графике активной позиции (см. current_price_marker)
+CURRENT_MARKER_STYLE = dict(size=15, color='orange', symbol='star', line=dict(width=2, color='white'))
+
+# История паттернов PatternTracker (тот же путь, что у него по умолчанию; пишет сканер)
+PATTERN_HISTORY = Path(__file__).parent / "pattern_history.json"
+
+# Таймфрейм в strategy_desc: сначала ищется в квадратных скобках, затем в круглых
+TIMEFRAME_BRACKETS_RE = re.compile(r'\[(\w+)\]')
+TIMEFRAME_PARENS_RE = re.compile(r'\((\w+)\)')
+
+@lru_cache(maxsize=1024)
 def extract_timeframe(strategy_desc):
     """Извлекает таймфрейм из strategy_desc (формат: [1h] или (1h) и т.д.)"""
     if not strategy_desc:
         return "N/A"
-    import re
-    # Try square brackets
-    match = re.search(r'\[(\w+)\]', strategy_desc)
-    if match:
-        return match.group(1)
-    # Try parentheses
-    match_p = re.search(r'\((\w+)\)', strategy_desc)
-    if match_p:
-        return match_p.group(1)
-    return "N/A"
+    match = TIMEFRAME_BRACKETS_RE.search(strategy_desc) or TIMEFRAME_PARENS_RE.search(strategy_desc)
+    return match.group(1) if match else "N/A"
+
+def entry_mode_column(df):
+    """
+    Тип входа по сделкам DataFrame: колонка entry_mode, а для старых сделок без нее
+    (или с 'Unknown') - определение по strategy_desc ('ema_squeeze' для EMA/зажатия, иначе 'Unknown')
+    """
+    if 'strategy_desc' in df.columns:
+        desc = df['strategy_desc'].fillna('').astype(str)
+    else:
+        desc = pd.Series('', index=df.index)
+    fallback = np.where(desc.str.contains('EMA|зажата', na=False), 'ema_squeeze', 'Unknown')
+    if 'entry_mode' not in df.columns:
+        return pd.Series(fallback, index=df.index)
+    known = df['entry_mode'].notna() & (df['entry_mode'] != 'Unknown')
+    return df['entry_mode'].where(known, fallback)
+
+def format_number_column(df, col, fmt):
+    """Колонка df, отформатированная строками по fmt (отсутствующие значения - как 0)"""
+    if col not in df.columns:
+        return pd.Series(fmt.format(0), index=df.index)
+    return pd.to_numeric(df[col], errors='coerce').fillna(0).map(fmt.format)
+
+def profit_by_group(df, col):
+    """
+    count/sum/mean net_profit по значениям col (округлено до 2 знаков), как
+    groupby(col)['net_profit'].agg(['count', 'sum', 'mean']), но за один проход np.bincount
+    """
+    codes, uniques = pd.factorize(df[col], sort=True)
+    profit = df['net_profit'].to_numpy(dtype=float)
+    valid = codes >= 0
+    codes, profit = codes[valid], profit[valid]
+    # Пропуски net_profit не считаются и не суммируются (как в groupby)
+    has_profit = ~np.isnan(profit)
+    count = np.bincount(codes[has_profit], minlength=len(uniques))
+    total = np.bincount(codes, weights=np.where(has_profit, profit, 0.0), minlength=len(uniques))
+    mean = np.where(count > 0, total / np.maximum(count, 1), np.nan)
+    return pd.DataFrame({'count': count, 'sum': total.round(2), 'mean': mean.round(2)},
+                        index=pd.Index(uniques, name=col))
+
+def active_trades_key(active_trades):
+    """Поля активных позиций, от которых зависят порядок и подписи (ключ кэша active_positions)"""
+    return tuple(
+        (ticker, data.get('entry_time', ''), data.get('direction'), data.get('strategy_desc', ''))
+        for ticker, data in active_trades.items()
+    )
+
+@st.cache_data(show_spinner=False)
+def active_positions(active_key, start_number):
+    """
+    Активные позиции в порядке входа: (тикеры, подписи "#N: TICKER (DIR) [tf] - HH:MM:SS").
+    Нумерация с start_number продолжает историю; пересчитывается только при изменении позиций.
+    """
+    ordered = sorted(active_key, key=lambda item: item[1])
+    tickers = [item[0] for item in ordered]
+    labels = []
+    for i, (ticker, entry_time, direction, strategy_desc) in enumerate(ordered, start_number):
+        entry_time_short = entry_time[11:19] if len(entry_time) > 19 else entry_time
+        timeframe = extract_timeframe(strategy_desc)
+        timeframe_str = f"[{timeframe}]" if timeframe != "N/A" else ""
+        labels.append(f"#{i}: {ticker} ({direction}) {timeframe_str} - {entry_time_short}")
+    return tickers, labels
+
+def _lazy_plotly():
+    """Импортирует Plotly при первом построении графика. Возвращает (px, go, make_subplots)"""
+    import plotly.express as px
+    import plotly.graph_objects as go
+    import plotly.io as pio
+    from plotly.subplots import make_subplots
+    if orjson is not None:
+        # Сериализация фигур Plotly через orjson: ndarray кодируются без поэлементной конвертации в Python
+        pio.json.config.default_engine = 'orjson'
+    return px, go, make_subplots
+
+def fast_load_json(path):
+    """Читает JSON-файл через orjson (если установлен), иначе через стандартный json"""
+    if orjson is not None:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def save_trades_json(path, trades):
+    """
+    Сохраняет словарь сделок в JSON (entry_time/exit_time заранее переводятся в ISO,
+    прочие несериализуемые значения - через str, как в TradeManager)
+    """
+    for trade in trades.values():
+        for key in ('entry_time', 'exit_time'):
+            value = trade.get(key)
+            if isinstance(value, datetime):
+                trade[key] = value.isoformat()
+    
+    # Пишем во временный файл и атомарно подменяем: бот никогда не увидит недописанный JSON
+    tmp_path = Path(path).with_suffix('.json.tmp')
+    if orjson is not None:
+        tmp_path.write_bytes(orjson.dumps(trades, default=str, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+    else:
+        with open(tmp_path, 'w') as f:
+            json.dump(trades, f, indent=2, default=str)
+    os.replace(tmp_path, path)
+
+@st.cache_data(show_spinner=False)
+def _load_json(path, mtime):
+    """Парсит JSON-файл. mtime - часть ключа кэша: файл перечитывается только после изменения"""
+    return fast_load_json(path)
 
 def load_data():
     """Загружает данные о сделках"""
@@ -59,75 +199,247 @@ def load_data():
     
     if TRADES_ACTIVE.exists():
         try:
-            with open(TRADES_ACTIVE, 'r') as f:
-                loaded_trades = json.load(f)
-                # Фильтруем только действительно активные позиции (status == 'OPEN')
-                # Также проверяем, что это словарь (не список)
-                if isinstance(loaded_trades, dict):
-                    active_trades = {
-                        ticker: trade 
-                        for ticker, trade in loaded_trades.items() 
-                        if trade.get('status', 'OPEN') == 'OPEN'
-                    }
-                    # Если после фильтрации остались закрытые позиции, сохраняем очищенный файл
-                    if len(active_trades) < len(loaded_trades):
-                        with open(TRADES_ACTIVE, 'w') as f_save:
-                            json.dump(active_trades, f_save, indent=4, default=str)
+            loaded_trades = _load_json(str(TRADES_ACTIVE), os.path.getmtime(TRADES_ACTIVE))
+            # Фильтруем только действительно активные позиции (status == 'OPEN')
+            # Также проверяем, что это словарь (не список)
+            if isinstance(loaded_trades, dict):
+                active_trades = {
+                    ticker: trade 
+                    for ticker, trade in loaded_trades.items() 
+                    if trade.get('status', 'OPEN') == 'OPEN'
+                }
+                # Если после фильтрации остались закрытые позиции, сохраняем очищенный файл.
+                # load_data() вызывается на каждом rerun, поэтому перезаписываем не чаще раза в минуту
+                # (файлом владеет бот, дашборд лишь подчищает за ним)
+                if len(active_trades) < len(loaded_trades):
+                    last_cleanup = st.session_state.get('last_active_cleanup', 0)
+                    if time.time() - last_cleanup > ACTIVE_CLEANUP_INTERVAL:
+                        save_trades_json(TRADES_ACTIVE, active_trades)
+                        st.session_state['last_active_cleanup'] = time.time()
         except Exception as e:
             print(f"Ошибка загрузки активных позиций: {e}")
         
     if TRADES_HISTORY.exists():
         try:
-            with open(TRADES_HISTORY, 'r') as f:
-                history_trades = json.load(f)
-                # Убеждаемся, что это список
-                if not isinstance(history_trades, list):
-                    history_trades = []
+            history_trades = _load_json(str(TRADES_HISTORY), os.path.getmtime(TRADES_HISTORY))
+            # Убеждаемся, что это список
+            if not isinstance(history_trades, list):
+                history_trades = []
         except Exception as e:
             print(f"Ошибка загрузки истории: {e}")
     
     return active_trades, history_trades
 
+@st.cache_data(show_spinner=False)
+def build_history_df(path, mtime):
+    """
+    DataFrame истории сделок с приведенными типами: net_profit (float), entry_time/exit_time
+    (naive UTC), hold_time_hours, timeframe и entry_mode. mtime - ключ кэша, как в _load_json.
+    """
+    history = _load_json(path, mtime)
+    df = pd.DataFrame(history if isinstance(history, list) else [])
+    if df.empty:
+        return df
+    for col in ('net_profit', 'entry_time', 'exit_time', 'strategy_desc'):
+        if col not in df.columns:
+            df[col] = np.nan
+    
+    df['net_profit'] = pd.to_numeric(df['net_profit'], errors='coerce').fillna(0)
+    # Подпись времени выхода для таблиц (MM-DD HH:MM) - из исходной строки, в таймзоне записи
+    df['exit_label'] = df['exit_time'].astype('string').str.slice(5, 16)
+    # Приводим время к UTC и убираем timezone одной векторной операцией
+    # (наивные значения трактуются как UTC, смешанные таймзоны приводятся корректно)
+    for col in ('entry_time', 'exit_time'):
+        df[col] = _to_naive_utc(df[col])
+    
+    # Время удержания; для NaT вычитание дает NaN
+    df['hold_time_hours'] = (df['exit_time'] - df['entry_time']).dt.total_seconds() / 3600
+    # Различных strategy_desc единицы, поэтому парсим каждый один раз и раскладываем через map
+    tf_map = {d: extract_timeframe(d) for d in df['strategy_desc'].dropna().unique()}
+    df['timeframe'] = df['strategy_desc'].map(tf_map).fillna('N/A')
+    df['entry_mode'] = entry_mode_column(df)
+    
+    # Низкокардинальные строковые колонки храним как category (словарное кодирование):
+    # меньше памяти, группировки и сравнения идут по целочисленным кодам
+    for col in HISTORY_CATEGORY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    return df
+
+def load_history_df():
+    """История сделок как DataFrame (из кэша build_history_df); пустой, если файла нет или он не читается"""
+    if not TRADES_HISTORY.exists():
+        return pd.DataFrame()
+    try:
+        return build_history_df(str(TRADES_HISTORY), os.path.getmtime(TRADES_HISTORY))
+    except Exception as e:
+        print(f"Ошибка загрузки истории: {e}")
+        return pd.DataFrame()
+
+@st.cache_data(show_spinner=False)
+def load_snapshot(path, mtime):
+    """Свечи из снэпшота сделки (только SNAPSHOT_COLUMNS). mtime - ключ кэша, как в _load_json"""
+    return pd.read_csv(path, usecols=lambda col: col in SNAPSHOT_COLUMNS, dtype=SNAPSHOT_DTYPES)
+
+@st.cache_data(show_spinner=False)
+def load_pattern(path, mtime):
+    """Паттерн сделки (T0-T4) из JSON рядом со снэпшотом. mtime - ключ кэша"""
+    return fast_load_json(path)
+
+def _nearest_time_index(times, target):
+    """
+    Индекс ближайшей по времени свечи в отсортированном массиве times (NaT в конце игнорируются).
+    Бинарный поиск через _nearest_sorted_time_indices вместо разницы со всем массивом
+    """
+    idx, diff = _nearest_sorted_time_indices(times, [np.datetime64(target, 'ns')])
+    if diff[0] == np.timedelta64(np.iinfo(np.int64).max, 'ns'):
+        raise ValueError("Нет свечей с корректным временем")
+    return int(idx[0])
+
+def _to_naive_utc(times):
+    """
+    Series времени (строки ISO8601 или datetime, с таймзоной или без) -> naive UTC datetime64
+    одним проходом; уже naive datetime64 возвращается как есть
+    """
+    if pd.api.types.is_datetime64_dtype(times):
+        return times
+    return pd.to_datetime(times, format='ISO8601', utc=True, errors='coerce').dt.tz_convert(None)
+
+def _nearest_sorted_time_indices(times, targets):
+    """
+    Индексы ближайших по времени свечей для массива targets в отсортированном по возрастанию
+    массиве times (datetime64, NaT в конце) и модули разниц. Один векторный бинарный поиск:
+    ближайшая свеча - одна из соседних с точкой вставки (при равенстве - более ранняя, как idxmin).
+    NaT дают разницу "бесконечность".
+    """
+    times = np.asarray(times, dtype='datetime64[ns]')
+    targets = np.asarray(targets, dtype='datetime64[ns]')
+    if len(times) == 0:
+        raise ValueError("Нет значений времени")
+    pos = np.searchsorted(times, targets)
+    left = np.clip(pos - 1, 0, len(times) - 1)
+    right = np.clip(pos, 0, len(times) - 1)
+    never = np.timedelta64(np.iinfo(np.int64).max, 'ns')
+    diff_left = np.abs(times[left] - targets)
+    diff_left[np.isnat(diff_left)] = never
+    diff_right = np.abs(times[right] - targets)
+    diff_right[np.isnat(diff_right)] = never
+    use_right = diff_right < diff_left
+    return np.where(use_right, right, left), np.where(use_right, diff_right, diff_left)
+
+def _ema(values, span):
+    """EMA по массиву цен (как pandas ewm(span, adjust=False))"""
+    return pd.Series(values).ewm(span=span, adjust=False).mean().to_numpy()
+
+def _lttb_indices(y, n_out):
+    """
+    Индексы n_out точек ряда y по алгоритму Largest-Triangle-Three-Buckets: первая и последняя
+    точки сохраняются, из каждой корзины между ними берется точка, образующая наибольший треугольник
+    с предыдущей выбранной точкой и средним следующей корзины (форма ряда сохраняется)
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    y = np.nan_to_num(np.asarray(y, dtype=float))
+    x = np.arange(n, dtype=float)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[hi:next_hi].mean()
+        avg_y = y[hi:next_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
+def downsample_chart_data(df, pattern_info, n_out=MAX_CHART_CANDLES):
+    """
+    Прореживает свечи до ~n_out (LTTB по close), если их больше. Свечи точек паттерна
+    сохраняются, а их idx в pattern_info пересчитываются под новый DataFrame. EMA, которых нет
+    в данных, считаются до прореживания, чтобы не искажаться. Возвращает новый DataFrame.
+    """
+    n = len(df)
+    if n <= n_out:
+        return df
+    df = df.copy()
+    close = df['close'].to_numpy(dtype=float)
+    for span in (7, 14):
+        if f'ema_{span}' not in df.columns:
+            df[f'ema_{span}'] = _ema(close, span)
+    
+    keep = np.zeros(n, dtype=bool)
+    keep[_lttb_indices(close, n_out)] = True
+    point_keys = [k for k in ('t0', 't1', 't2', 't3', 't4')
+                  if pattern_info and isinstance(pattern_info.get(k), dict) and 'idx' in pattern_info[k]]
+    for k in point_keys:
+        idx = int(pattern_info[k]['idx'])
+        if 0 <= idx < n:
+            keep[idx] = True
+    
+    kept = np.flatnonzero(keep)
+    for k in point_keys:
+        idx = int(pattern_info[k]['idx'])
+        if 0 <= idx < n:
+            pattern_info[k]['idx'] = int(np.searchsorted(kept, idx))
+    return df[keep].reset_index(drop=True)
+
 def create_trade_chart(df, pattern_info, trade_data):
     """
     Создает график сделки с паттерном, точками входа и выхода
     
+    DataFrame вызывающего кода не изменяется: нужные колонки один раз
+    выгружаются в NumPy-массивы (отсортированные по времени), дальше
+    вся работа идет с массивами.
+    
     Args:
         df: DataFrame со свечами
         pattern_info: Словарь с информацией о паттерне (T0-T4)
         trade_data: Словарь с данными о сделке (entry_price, exit_price, stop_loss, take_profit, entry_time)
     """
-    # Убеждаемся, что DataFrame отсортирован по времени
-    if 'time' in df.columns:
-        # Нормализуем timezone - убираем timezone info для корректного сравнения
-        if pd.api.types.is_datetime64_any_dtype(df['time']):
-            if df['time'].dt.tz is not None:
-                df['time'] = df['time'].dt.tz_localize(None)
-        # Если время строкой, пробуем преобразовать
-        elif pd.api.types.is_object_dtype(df['time']):
-             try:
-                 df['time'] = pd.to_datetime(df['time'], format='ISO8601', errors='coerce')
-                 if df['time'].dt.tz is not None:
-                     df['time'] = df['time'].dt.tz_localize(None)
-             except:
-                 pass
-                 
-        df = df.sort_values('time').reset_index(drop=True)
-    
     # Проверяем наличие всех необходимых колонок
     required_cols = ['open', 'high', 'low', 'close']
     for col in required_cols:
         if col not in df.columns:
             raise ValueError(f"Отсутствует обязательная колонка: {col}")
-        # Заполняем пропущенные значения
-        if df[col].isna().any():
-            df[col] = df[col].fillna(method='ffill').fillna(method='bfill')
     
-    # Вычисляем EMA, если их нет в данных
-    if 'ema_7' not in df.columns:
-        df['ema_7'] = df['close'].ewm(span=7, adjust=False).mean()
-    if 'ema_14' not in df.columns:
-        df['ema_14'] = df['close'].ewm(span=14, adjust=False).mean()
+    _, go, make_subplots = _lazy_plotly()
+    n = len(df)
+    has_time = 'time' in df.columns
+    order = np.arange(n)
+    time_arr = None
+    
+    # Убеждаемся, что свечи отсортированы по времени
+    if has_time:
+        time_s = df['time']
+        # Нормализуем timezone - убираем timezone info для корректного сравнения
+        if pd.api.types.is_datetime64_any_dtype(time_s):
+            if time_s.dt.tz is not None:
+                time_s = time_s.dt.tz_localize(None)
+        # Если время строкой, пробуем преобразовать
+        elif pd.api.types.is_object_dtype(time_s):
+            try:
+                time_s = pd.to_datetime(time_s, format='ISO8601', errors='coerce')
+                if time_s.dt.tz is not None:
+                    time_s = time_s.dt.tz_localize(None)
+            except:
+                pass
+        order = np.argsort(time_s.to_numpy(), kind='stable')
+        time_arr = time_s.to_numpy()[order]
+    
+    # OHLC одним блоком, с заполнением пропусков
+    ohlc = df[required_cols].iloc[order]
+    if ohlc.isna().to_numpy().any():
+        ohlc = ohlc.ffill().bfill()
+    o, h, l, c_arr = (ohlc[col].to_numpy(dtype=float) for col in required_cols)
+    v = df['volume'].to_numpy()[order]
+    
+    # EMA берем из данных, если есть, иначе вычисляем
+    ema_7 = df['ema_7'].to_numpy(dtype=float)[order] if 'ema_7' in df.columns else _ema(c_arr, 7)
+    ema_14 = df['ema_14'].to_numpy(dtype=float)[order] if 'ema_14' in df.columns else _ema(c_arr, 14)
     
     fig = make_subplots(
         rows=2, cols=1,
@@ -138,17 +450,21 @@ def create_trade_chart(df, pattern_info, trade_data):
     )
     
     # Используем индексы для оси X (как в дашборде разметки)
-    indices_x = list(range(len(df)))
-    customdata_candles = [[i, df.iloc[i]['time']] for i in range(len(df))] if 'time' in df.columns else [[i, ''] for i in range(len(df))]
+    indices_x = np.arange(n, dtype=np.int32)
+    # customdata - один массив (n, 2), общий для свечей и объема
+    customdata_candles = np.empty((n, 2), dtype=object)
+    customdata_candles[:, 0] = indices_x
+    customdata_candles[:, 1] = pd.Index(time_arr).astype(object) if has_time else ''
     
-    # Свечи - используем такой же стиль как в дашборде разметки
+    # Свечи - используем такой же стиль как в дашборде разметки.
+    # В браузер OHLC уходит в float32 (вдвое меньше данных); расчеты ниже идут по float64-массивам
     fig.add_trace(
         go.Candlestick(
             x=indices_x,
-            open=df['open'],
-            high=df['high'],
-            low=df['low'],
-            close=df['close'],
+            open=o.astype(np.float32),
+            high=h.astype(np.float32),
+            low=l.astype(np.float32),
+            close=c_arr.astype(np.float32),
             name='Цена',
             customdata=customdata_candles,
             hovertemplate='<b>Индекс:</b> %{customdata[0]}<br>' +
@@ -162,10 +478,10 @@ def create_trade_chart(df, pattern_info, trade_data):
     )
     
     # Добавляем EMA 7
-    if 'ema_7' in df.columns and not df['ema_7'].isna().all():
+    if not np.isnan(ema_7).all():
         fig.add_trace(go.Scatter(
             x=indices_x,
-            y=df['ema_7'],
+            y=ema_7,
             mode='lines',
             line=dict(color='yellow', width=1),
             name='EMA 7',
@@ -174,10 +490,10 @@ def create_trade_chart(df, pattern_info, trade_data):
         ), row=1, col=1)
     
     # Добавляем EMA 14
-    if 'ema_14' in df.columns and not df['ema_14'].isna().all():
+    if not np.isnan(ema_14).all():
         fig.add_trace(go.Scatter(
             x=indices_x,
-            y=df['ema_14'],
+            y=ema_14,
             mode='lines',
             line=dict(color='purple', width=1),
             name='EMA 14',
@@ -191,7 +507,7 @@ def create_trade_chart(df, pattern_info, trade_data):
         corrected_indices = {}
         
         # Если в dataframe есть время, используем его для сопоставления
-        if 'time' in df.columns:
+        if has_time:
             for point_key in ['t0', 't1', 't2', 't3', 't4']:
                 if point_key in pattern_info and 'time' in pattern_info[point_key]:
                     try:
@@ -201,19 +517,10 @@ def create_trade_chart(df, pattern_info, trade_data):
                         if pt.tzinfo is not None:
                             pt = pt.replace(tzinfo=None)
                         
-                        # Находим ближайшую свечу в df
-                        # Используем float для вычитания, чтобы избежать проблем с таймзонами
-                        # Преобразуем колонку времени в df в naive, если нужно (уже сделано в начале функции, но на всякий случай)
-                        
-                        # Вычисляем разницу по модулю
-                        time_diffs = abs(df['time'] - pt)
-                        closest_idx = time_diffs.idxmin()
-                        min_diff = time_diffs.min()
-                        
-                        # Если разница небольшая (например, меньше интервала свечи * 2 или просто разумная)
+                        # Находим ближайшую свечу (по модулю разницы времени)
                         # Для дневного ТФ это может быть много часов, для минутного - минуты
                         # Берем просто ближайшую, так как snapshot должен содержать эту точку
-                        corrected_indices[point_key] = int(closest_idx)
+                        corrected_indices[point_key] = _nearest_time_index(time_arr, pt)
                     except Exception as e:
                         print(f"Ошибка корректировки индекса для {point_key}: {e}")
                         pass
@@ -239,7 +546,7 @@ def create_trade_chart(df, pattern_info, trade_data):
                     point_price = float(point['price'])
                     
                     # Проверяем, что точка в диапазоне
-                    if 0 <= point_idx < len(df):
+                    if 0 <= point_idx < n:
                         # Используем индекс
                         point_x = point_idx
                         fig.add_trace(go.Scatter(
@@ -270,7 +577,7 @@ def create_trade_chart(df, pattern_info, trade_data):
             t1_idx = get_point_idx('t1')
             
             if t0_idx is not None and t1_idx is not None:
-                if 0 <= t0_idx < len(df) and 0 <= t1_idx < len(df):
+                if 0 <= t0_idx < n and 0 <= t1_idx < n:
                     fig.add_trace(go.Scatter(
                         x=[t0_idx, t1_idx],
                         y=[float(t0['price']), float(t1['price'])],
@@ -288,7 +595,7 @@ def create_trade_chart(df, pattern_info, trade_data):
             t3_idx = get_point_idx('t3')
             
             if t1_idx is not None and t3_idx is not None:
-                if 0 <= t1_idx < len(df) and 0 <= t3_idx < len(df):
+                if 0 <= t1_idx < n and 0 <= t3_idx < n:
                     fig.add_trace(go.Scatter(
                         x=[t1_idx, t3_idx],
                         y=[float(t1['price']), float(t3['price'])],
@@ -305,7 +612,7 @@ def create_trade_chart(df, pattern_info, trade_data):
             t4_idx = get_point_idx('t4')
             
             if t2_idx is not None and t4_idx is not None:
-                if 0 <= t2_idx < len(df) and 0 <= t4_idx < len(df):
+                if 0 <= t2_idx < n and 0 <= t4_idx < n:
                     fig.add_trace(go.Scatter(
                         x=[t2_idx, t4_idx],
                         y=[float(t2['price']), float(t4['price'])],
@@ -321,15 +628,13 @@ def create_trade_chart(df, pattern_info, trade_data):
         entry_idx = None
         
         # 1. Пробуем найти индекс по времени входа
-        if 'entry_time' in trade_data and trade_data['entry_time'] and 'time' in df.columns:
+        if 'entry_time' in trade_data and trade_data['entry_time'] and has_time:
             try:
                 entry_dt = pd.to_datetime(trade_data['entry_time']).replace(tzinfo=None)
                 # Ищем ближайшую свечу (разница по модулю минимальна)
-                time_diff = abs(df['time'] - entry_dt)
-                
                 # Если разница небольшая (например, меньше 2 интервалов свечи), считаем совпадением
                 # Но для простоты берем просто ближайшую
-                entry_idx = time_diff.idxmin()
+                entry_idx = _nearest_time_index(time_arr, entry_dt)
             except Exception as e:
                 print(f"Ошибка поиска индекса по времени: {e}")
         
@@ -338,10 +643,10 @@ def create_trade_chart(df, pattern_info, trade_data):
             if pattern_info and 't4' in pattern_info and 'idx' in pattern_info['t4']:
                 entry_idx = int(pattern_info['t4']['idx'])
             else:
-                entry_idx = len(df) - 1
+                entry_idx = n - 1
         
         # Ограничиваем индекс диапазоном
-        entry_idx = max(0, min(len(df) - 1, entry_idx))
+        entry_idx = max(0, min(n - 1, entry_idx))
         
         fig.add_trace(go.Scatter(
             x=[entry_idx],
@@ -358,14 +663,13 @@ def create_trade_chart(df, pattern_info, trade_data):
     # Точка выхода (если есть)
     if 'exit_price' in trade_data and trade_data.get('exit_price'):
         exit_price = trade_data['exit_price']
-        exit_idx = len(df) - 1 # Default
+        exit_idx = n - 1 # Default
         
         # 1. Пробуем найти по времени выхода
-        if 'exit_time' in trade_data and trade_data['exit_time'] and 'time' in df.columns:
+        if 'exit_time' in trade_data and trade_data['exit_time'] and has_time:
             try:
                 exit_dt = pd.to_datetime(trade_data['exit_time']).replace(tzinfo=None)
-                time_diff = abs(df['time'] - exit_dt)
-                exit_idx = time_diff.idxmin()
+                exit_idx = _nearest_time_index(time_arr, exit_dt)
             except:
                 pass
         # 2. Если времени нет, ищем по цене после входа
@@ -377,12 +681,11 @@ def create_trade_chart(df, pattern_info, trade_data):
                  start_search = int(pattern_info['t4']['idx'])
              
              min_diff = float('inf')
-             for i in range(start_search + 1, len(df)):
-                candle = df.iloc[i]
-                if candle['low'] <= exit_price <= candle['high']:
+             for i in range(start_search + 1, n):
+                if l[i] <= exit_price <= h[i]:
                     exit_idx = i
                     break
-                diff = min(abs(candle['close'] - exit_price), abs(candle['open'] - exit_price))
+                diff = min(abs(c_arr[i] - exit_price), abs(o[i] - exit_price))
                 if diff < min_diff:
                     min_diff = diff
                     exit_idx = i
@@ -403,7 +706,7 @@ def create_trade_chart(df, pattern_info, trade_data):
     if 'stop_loss' in trade_data:
         sl_price = trade_data['stop_loss']
         fig.add_trace(go.Scatter(
-            x=[0, len(df) - 1],
+            x=[0, n - 1],
             y=[sl_price, sl_price],
             mode='lines',
             line=dict(color='red', width=2, dash='dot'),
@@ -414,7 +717,7 @@ def create_trade_chart(df, pattern_info, trade_data):
     if 'take_profit' in trade_data:
         tp_price = trade_data['take_profit']
         fig.add_trace(go.Scatter(
-            x=[0, len(df) - 1],
+            x=[0, n - 1],
             y=[tp_price, tp_price],
             mode='lines',
             line=dict(color='green', width=2, dash='dot'),
@@ -423,11 +726,10 @@ def create_trade_chart(df, pattern_info, trade_data):
         ), row=1, col=1)
     
     # Объем
-    colors_volume = ['red' if df.iloc[i]['close'] < df.iloc[i]['open'] else 'green' 
-                     for i in range(len(df))]
+    colors_volume = np.where(c_arr < o, 'red', 'green')
     fig.add_trace(go.Bar(
         x=indices_x,
-        y=df['volume'],
+        y=v,
         name='Объем',
         marker_color=colors_volume,
         customdata=customdata_candles,
@@ -437,27 +739,15 @@ def create_trade_chart(df, pattern_info, trade_data):
     ), row=2, col=1)
     
     # Настройка меток оси X (как в дашборде разметки)
-    tick_step = max(1, len(df) // 20)
-    tick_indices = list(range(0, len(df), tick_step))
-    tick_times = []
-    if 'time' in df.columns:
-        for i in tick_indices:
-            time_val = df.iloc[i]['time']
-            if pd.isna(time_val):
-                tick_times.append('')
-            elif isinstance(time_val, pd.Timestamp):
-                # Определяем формат на основе таймфрейма (если можем определить)
-                # Для дневного таймфрейма используем только дату
-                if len(df) > 1:
-                    time_diff = (df.iloc[-1]['time'] - df.iloc[0]['time']) / len(df)
-                    if time_diff.total_seconds() > 20 * 3600:
-                        tick_times.append(time_val.strftime('%Y-%m-%d'))
-                    else:
-                        tick_times.append(time_val.strftime('%Y-%m-%d %H:%M'))
-                else:
-                    tick_times.append(time_val.strftime('%Y-%m-%d %H:%M'))
-            else:
-                tick_times.append(str(time_val))
+    tick_step = max(1, n // 20)
+    tick_indices = np.arange(0, n, tick_step, dtype=np.int32)
+    if has_time and np.issubdtype(time_arr.dtype, np.datetime64):
+        # Для дневного таймфрейма используем только дату
+        is_daily = n > 1 and (time_arr[-1] - time_arr[0]) / n > np.timedelta64(20, 'h')
+        time_format = '%Y-%m-%d' if is_daily else '%Y-%m-%d %H:%M'
+        tick_times = pd.DatetimeIndex(time_arr[tick_indices]).strftime(time_format).fillna('').tolist()
+    elif has_time:
+        tick_times = ['' if pd.isna(t) else str(t) for t in time_arr[tick_indices]]
     else:
         tick_times = [str(i) for i in tick_indices]
     
@@ -525,47 +815,281 @@ def create_trade_chart(df, pattern_info, trade_data):
     
     return fig
 
-def get_current_candles(ticker, class_code, from_date, interval=CandleInterval.CANDLE_INTERVAL_HOUR):
-    """Загружает актуальные свечи для тикера"""
+@st.cache_data(show_spinner=False)
+def history_trade_chart(snapshot_path, snapshot_mtime, pattern_path, pattern_mtime, trade_data):
+    """
+    График закрытой сделки. Снэпшот и паттерн закрытой сделки не меняются, поэтому
+    фигура кэшируется по путям и mtime файлов (pattern_path=None - паттерна нет)
+    """
+    df_snapshot = load_snapshot(snapshot_path, snapshot_mtime)
+    pattern_info = load_pattern(pattern_path, pattern_mtime) if pattern_path else None
+    return create_trade_chart(df_snapshot, pattern_info, trade_data)
+
+def _chart_frame_key(df):
+    """
+    Дешевый ключ кэша для DataFrame свечей вместо хэширования всех данных:
+    длина, время первой и последней свечи и OHLC последней свечи
+    """
+    if df.empty:
+        return (0,)
+    times = (df['time'] if 'time' in df.columns else df.index).to_numpy()
+    ohlc_cols = [col for col in ('open', 'high', 'low', 'close') if col in df.columns]
+    last = tuple(df[ohlc_cols].to_numpy(dtype=float)[-1])
+    return (len(df), str(times[0]), str(times[-1]), tuple(ohlc_cols), last)
+
+@st.cache_data(show_spinner=False, hash_funcs={pd.DataFrame: _chart_frame_key})
+def cached_trade_chart(df, pattern_info, trade_data):
+    """
+    create_trade_chart с кэшем для графика активной позиции: повторный просмотр той же сделки
+    на тех же свечах (rerun'ы от виджетов) не пересобирает фигуру. Маркер текущей цены
+    добавляется к копии из кэша снаружи
+    """
+    return create_trade_chart(df, pattern_info, trade_data)
+
+def current_price_marker(x, price, pnl):
+    """
+    Маркер CURRENT с текущей ценой для графика активной позиции. Координаты передаются
+    numpy-массивами, чтобы plotly сериализовал их в бинарном виде, а не списками JSON
+    """
+    _, go, _ = _lazy_plotly()
+    return go.Scatter(
+        x=np.array([x]),
+        y=np.array([price], dtype=np.float32),
+        mode='markers+text',
+        marker=CURRENT_MARKER_STYLE,
+        text=['CURRENT'],
+        textposition='top center',
+        name='Текущая цена',
+        showlegend=True,
+        hovertemplate=f'<b>ТЕКУЩАЯ ЦЕНА</b><br>Цена: {price:.2f}<br>P&L: {pnl:.2f}<extra></extra>'
+    )
+
+@st.cache_data(show_spinner=False)
+def equity_curve_fig(_df_history, history_mtime):
+    """Кривая доходности. Ключ кэша - mtime файла истории (_df_history не хешируется)"""
+    px, _, _ = _lazy_plotly()
+    df_curve = _df_history.sort_values('exit_time')
+    df_curve['cumulative_pnl'] = df_curve['net_profit'].cumsum()
+    
+    fig = px.line(df_curve, x='exit_time', y='cumulative_pnl', markers=True)
+    fig.update_layout(
+        xaxis_title="Дата и время",
+        yaxis_title="P&L (RUB)",
+        xaxis=dict(tickformat='%d.%m.%Y %H:%M')
+    )
+    return fig
+
+@st.cache_data(show_spinner=False)
+def analytics_figs(_df_history, history_mtime):
+    """Распределение P&L и времени удержания. Ключ кэша - mtime файла истории"""
+    px, _, _ = _lazy_plotly()
+    fig_hist = px.histogram(_df_history, x='net_profit', nbins=20, 
+                           title='Распределение P&L по сделкам',
+                           labels={'net_profit': 'P&L (₽)', 'count': 'Количество'})
+    fig_hist.add_vline(x=0, line_dash="dash", line_color="red", 
+                      annotation_text="Безубыток")
+    
+    # Время удержания позиций
+    fig_hold = px.box(_df_history, y='hold_time_hours', 
+                     title='Время удержания позиций (часы)',
+                     labels={'hold_time_hours': 'Часы'})
+    return fig_hist, fig_hold
+
+def get_current_candles(ticker, class_code, from_date, interval=None):
+    """Загружает актуальные свечи для тикера (interval по умолчанию - часовые свечи).
+    Ошибки API пробрасываются наружу, чтобы пустой результат не попал в кэш cached_current_candles"""
     token = os.environ.get("TINKOFF_INVEST_TOKEN")
     if not token:
         return pd.DataFrame()
     
+    from t_tech.invest import Client, CandleInterval, InstrumentIdType
+    from t_tech.invest.utils import quotation_to_decimal
+    if interval is None:
+        interval = CandleInterval.CANDLE_INTERVAL_HOUR
+    
+    with Client(token) as client:
+        item = client.instruments.get_instrument_by(
+            id_type=InstrumentIdType.INSTRUMENT_ID_TYPE_TICKER,
+            class_code=class_code,
+            id=ticker
+        ).instrument
+        
+        candles = client.get_all_candles(
+            instrument_id=item.uid,
+            from_=from_date,
+            to=datetime.now(),
+            interval=interval
+        )
+        
+        data = []
+        for c in candles:
+            data.append({
+                'time': c.time,
+                'open': float(quotation_to_decimal(c.open)),
+                'high': float(quotation_to_decimal(c.high)),
+                'low': float(quotation_to_decimal(c.low)),
+                'close': float(quotation_to_decimal(c.close)),
+                'volume': c.volume
+            })
+        
+        df = pd.DataFrame(data)
+        if not df.empty:
+            # Вычисляем EMA
+            df['ema_7'] = df['close'].ewm(span=7, adjust=False).mean()
+            df['ema_14'] = df['close'].ewm(span=14, adjust=False).mean()
+        return df
+
+@st.cache_data(ttl=60, show_spinner=False)
+def cached_current_candles(ticker, class_code, from_bucket, interval_name):
+    """
+    get_current_candles с кэшем на 60 сек. from_bucket - начало периода, округленное вниз до часа,
+    чтобы ключ кэша не менялся между rerun'ами; interval_name - имя CandleInterval (None - часовые).
+    Исключения st.cache_data не кэширует - ошибку показывает вызывающий код, следующий rerun повторит запрос
+    """
+    interval = None
+    if interval_name:
+        from t_tech.invest import CandleInterval
+        interval = CandleInterval[interval_name]
+    return get_current_candles(ticker, class_code, from_bucket.to_pydatetime(), interval)
+
+@st.cache_data(show_spinner=False)
+def timeframe_settings(timeframe):
+    """
+    (имя CandleInterval, days_back) для таймфрейма из config.TIMEFRAMES; для неизвестного - (None, 60),
+    т.е. часовые свечи get_current_candles. Кэшируется, поэтому config импортируется один раз, а не на каждом rerun
+    """
+    from config import TIMEFRAMES
+    if timeframe in TIMEFRAMES:
+        return TIMEFRAMES[timeframe]['interval'].name, TIMEFRAMES[timeframe]['days_back']
+    return None, 60
+
+@st.cache_resource(max_entries=1)
+def _get_pattern_tracker(mtime):
+    """
+    Общий PatternTracker для всех rerun'ов. mtime файла истории - ключ кэша: трекер
+    пересоздается (и перечитывает файл) только когда сканер дописал историю.
+    """
+    return PatternTracker()
+
+def get_pattern_tracker():
+    mtime = PATTERN_HISTORY.stat().st_mtime if PATTERN_HISTORY.exists() else 0
+    return _get_pattern_tracker(mtime)
+
+@st.cache_data(ttl=5, show_spinner=False)
+def get_pattern_history(ticker, tf, limit=20):
+    """PatternTracker.get_pattern_history с кэшем на 5 сек"""
+    return get_pattern_tracker().get_pattern_history(ticker, tf, limit=limit)
+
+@st.cache_resource
+def _price_cache():
+    """
+    Кэш цен закрытия {(uid, direction): (price, monotonic_ts)}.
+    Через cache_resource, т.к. глобальные переменные скрипта сбрасываются на каждом rerun.
+    """
+    return {}
+
+async def fetch_close_price(client, trade, last_by_uid, now_iso):
+    """
+    Возвращает {'price', 'time'} для закрытия позиции или None, если у сделки нет uid
+    (client - AsyncClient, запросы по разным сделкам выполняются конкурентно)
+    
+    last_by_uid - последние цены, полученные одним батч-запросом (см. fetch_close_prices),
+    используются как запасной вариант вместо отдельного get_last_prices на каждую сделку.
+    now_iso - общее для всех позиций время снимка цен.
+    """
+    from t_tech.invest.utils import quotation_to_decimal
+    uid = trade.get('uid')
+    if not uid:
+        return None
+    direction = trade.get('direction', 'LONG')
+    fallback_price = last_by_uid.get(uid, trade.get('entry_price', 0))
+    
+    # Цена из стакана, полученная меньше PRICE_CACHE_TTL сек назад, используется повторно
+    # (ключ включает направление: для LONG это bid, для SHORT - ask)
+    cache = _price_cache()
+    cached = cache.get((uid, direction))
+    if cached and (time.monotonic() - cached[1]) < PRICE_CACHE_TTL:
+        return {
+            'price': cached[0],
+            'time': now_iso
+        }
+    
+    # Для закрытия позиции нужна правильная цена:
+    # LONG (продажа) -> bid цена (цена покупки в стакане)
+    # SHORT (покупка) -> ask цена (цена продажи в стакане)
     try:
-        with Client(token) as client:
-            item = client.instruments.get_instrument_by(
-                id_type=InstrumentIdType.INSTRUMENT_ID_TYPE_TICKER,
-                class_code=class_code,
-                id=ticker
-            ).instrument
-            
-            candles = client.get_all_candles(
-                instrument_id=item.uid,
-                from_=from_date,
-                to=datetime.now(),
-                interval=interval
-            )
-            
-            data = []
-            for c in candles:
-                data.append({
-                    'time': c.time,
-                    'open': float(quotation_to_decimal(c.open)),
-                    'high': float(quotation_to_decimal(c.high)),
-                    'low': float(quotation_to_decimal(c.low)),
-                    'close': float(quotation_to_decimal(c.close)),
-                    'volume': c.volume
-                })
-            
-            df = pd.DataFrame(data)
-            if not df.empty:
-                # Вычисляем EMA
-                df['ema_7'] = df['close'].ewm(span=7, adjust=False).mean()
-                df['ema_14'] = df['close'].ewm(span=14, adjust=False).mean()
-            return df
-    except Exception as e:
-        st.error(f"Ошибка загрузки свечей для {ticker}: {e}")
-        return pd.DataFrame()
+        # Получаем стакан (order book) для bid/ask
+        orderbook = await client.market_data.get_order_book(instrument_id=uid, depth=1)
+        
+        if direction == 'LONG':
+            # Для LONG позиции закрываем продажей -> используем bid (цена покупки)
+            levels = orderbook.bids
+        else:  # SHORT
+            # Для SHORT позиции закрываем покупкой -> используем ask (цена продажи)
+            levels = orderbook.asks
+        
+        if levels and len(levels) > 0:
+            price = float(quotation_to_decimal(levels[0].price))
+            cache[(uid, direction)] = (price, time.monotonic())
+        else:
+            # Если стакан пуст с нужной стороны, используем last_price
+            price = fallback_price
+    except Exception:
+        # Если не удалось получить стакан, используем last_price
+        price = fallback_price
+    
+    if price <= 0:
+        price = trade.get('entry_price', 0)
+        
+    return {
+        'price': price,
+        'time': now_iso
+    }
+
+async def _gather_close_prices(token, active_trades):
+    """Цены закрытия по всем позициям через один AsyncClient (см. fetch_close_prices)"""
+    from t_tech.invest import AsyncClient
+    from t_tech.invest.utils import quotation_to_decimal
+    uids = [t['uid'] for t in active_trades.values() if t.get('uid')]
+    async with AsyncClient(token) as client:
+        last_by_uid = {}
+        if uids:
+            try:
+                response = await client.market_data.get_last_prices(instrument_id=uids)
+                last_by_uid = {
+                    lp.instrument_uid: float(quotation_to_decimal(lp.price))
+                    for lp in (response.last_prices or [])
+                }
+            except Exception:
+                # Без последних цен запасным вариантом остается entry_price
+                pass
+        
+        now_iso = datetime.now().isoformat()
+        results = await asyncio.gather(*(
+            fetch_close_price(client, trade, last_by_uid, now_iso)
+            for trade in active_trades.values()
+        ))
+    
+    return {
+        ticker: price_info
+        for ticker, price_info in zip(active_trades, results)
+        if price_info is not None
+    }
+
+def fetch_close_prices(token, active_trades):
+    """
+    Получает цены закрытия для всех активных позиций.
+    
+    Последние цены по всем инструментам запрашиваются одним вызовом get_last_prices.
+    У стакана батч-метода нет, поэтому запросы get_order_book выполняются конкурентно
+    (asyncio.gather на одном AsyncClient): N позиций = ~2 сетевых RTT вместо N последовательных.
+    
+    Returns:
+        Словарь {ticker: {'price': float, 'time': str}}
+    """
+    if not active_trades:
+        return {}
+    return asyncio.run(_gather_close_prices(token, active_trades))
 
 def main():
     # Определяем режим из переменной окружения для подписи
@@ -589,8 +1113,7 @@ def main():
     trading_config = {}
     if config_file.exists():
         try:
-            with open(config_file, 'r') as f:
-                trading_config = json.load(f)
+            trading_config = fast_load_json(config_file)
         except Exception:
             pass
     current_lot = int(trading_config.get('fixed_lot_size', 1))
@@ -702,7 +1225,6 @@ def main():
     with col_auto:
         auto_refresh = st.checkbox("🔄 Автообновление (30 сек)", value=False, key="auto_refresh")
         if auto_refresh:
-            import time
             time.sleep(30)
             st.rerun()
     
@@ -713,119 +1235,34 @@ def main():
                 try:
                     # Получаем текущие цены через API
                     token = os.environ.get("TINKOFF_INVEST_TOKEN")
-                    current_prices = {}
-                    
-                    if token:
-                        with Client(token) as client:
-                            for ticker, trade in active_trades.items():
-                                try:
-                                    uid = trade.get('uid')
-                                    direction = trade.get('direction', 'LONG')
-                                    
-                                    if uid:
-                                        # Для закрытия позиции нужна правильная цена:
-                                        # LONG (продажа) -> bid цена (цена покупки в стакане)
-                                        # SHORT (покупка) -> ask цена (цена продажи в стакане)
-                                        
-                                        try:
-                                            # Получаем стакан (order book) для bid/ask
-                                            orderbook = client.market_data.get_order_book(figi=uid, depth=1)
-                                            
-                                            if direction == 'LONG':
-                                                # Для LONG позиции закрываем продажей -> используем bid (цена покупки)
-                                                if orderbook.bids and len(orderbook.bids) > 0:
-                                                    price = float(quotation_to_decimal(orderbook.bids[0].price))
-                                                else:
-                                                    # Если нет bid, используем last_price
-                                                    last_price = client.market_data.get_last_prices(figi=[uid])
-                                                    if last_price.last_prices:
-                                                        price = float(quotation_to_decimal(last_price.last_prices[0].price))
-                                                    else:
-                                                        price = trade.get('entry_price', 0)
-                                            else:  # SHORT
-                                                # Для SHORT позиции закрываем покупкой -> используем ask (цена продажи)
-                                                if orderbook.asks and len(orderbook.asks) > 0:
-                                                    price = float(quotation_to_decimal(orderbook.asks[0].price))
-                                                else:
-                                                    # Если нет ask, используем last_price
-                                                    last_price = client.market_data.get_last_prices(figi=[uid])
-                                                    if last_price.last_prices:
-                                                        price = float(quotation_to_decimal(last_price.last_prices[0].price))
-                                                    else:
-                                                        price = trade.get('entry_price', 0)
-                                        except Exception as e:
-                                            # Если не удалось получить стакан, используем last_price
-                                            try:
-                                                last_price = client.market_data.get_last_prices(figi=[uid])
-                                                if last_price.last_prices:
-                                                    price = float(quotation_to_decimal(last_price.last_prices[0].price))
-                                                else:
-                                                    price = trade.get('entry_price', 0)
-                                            except:
-                                                price = trade.get('entry_price', 0)
-                                        
-                                        if price <= 0:
-                                            price = trade.get('entry_price', 0)
-                                            
-                                        current_prices[ticker] = {
-                                            'price': price,
-                                            'time': datetime.now().isoformat()
-                                        }
-                                except Exception as e:
-                                    # Если не удалось получить цену, используем last_price или entry_price
-                                    try:
-                                        uid = trade.get('uid')
-                                        if uid:
-                                            last_price = client.market_data.get_last_prices(figi=[uid])
-                                            if last_price.last_prices:
-                                                price = float(quotation_to_decimal(last_price.last_prices[0].price))
-                                            else:
-                                                price = trade.get('entry_price', 0)
-                                        else:
-                                            price = trade.get('entry_price', 0)
-                                    except:
-                                        price = trade.get('entry_price', 0)
-                                    
-                                    if price <= 0:
-                                        price = trade.get('entry_price', 0)
-                                        
-                                    current_prices[ticker] = {
-                                        'price': price,
-                                        'time': datetime.now().isoformat()
-                                    }
+                    current_prices = fetch_close_prices(token, active_trades) if token else {}
                     
                     # Закрываем все позиции через TradeManager
-                    import importlib
-                    import trading_bot.trade_manager
-                    importlib.reload(trading_bot.trade_manager)
+                    # (импорт кэшируется в sys.modules; перезагрузка модуля - только для отладки)
+                    if os.getenv("DEV_RELOAD"):
+                        import importlib
+                        import trading_bot.trade_manager
+                        importlib.reload(trading_bot.trade_manager)
                     from trading_bot.trade_manager import TradeManager
                     
                     # Используем тот же data_dir, что и дашборд; в PROD — реальные заявки на закрытие
                     is_prod = (os.environ.get("BOT_ENV") == "PROD") or ("data_prod" in DATA_DIR_PATH)
                     manager = TradeManager(token, dry_run=not is_prod, debug_mode=not is_prod, data_dir=DATA_DIR_PATH)
                     
-                    # Используем метод close_all_positions, который правильно обрабатывает все
-                    manager.close_all_positions(current_prices)
-                    
-                    # ДОПОЛНИТЕЛЬНАЯ ПРОВЕРКА: убеждаемся, что файл действительно очищен
-                    # Загружаем файл и проверяем
-                    import time
-                    time.sleep(0.5)  # Даем время на сохранение
-                    
-                    # Проверяем результат
-                    with open(TRADES_ACTIVE, 'r') as f:
-                        remaining_trades = json.load(f)
-                    remaining_count = len([t for t in remaining_trades.values() if t.get('status') == 'OPEN'])
-                    
+                    # Используем метод close_all_positions, который правильно обрабатывает все.
+                    # Он атомарно сохраняет файл и возвращает оставшиеся (не закрытые) сделки -
+                    # перечитывать файл не нужно
+                    remaining_trades = manager.close_all_positions(current_prices)
+                    remaining_count = len(remaining_trades)
                     if remaining_count > 0:
-                        # Если остались позиции, принудительно очищаем файл
-                        cleaned_trades = {k: v for k, v in remaining_trades.items() if v.get('status') == 'OPEN'}
-                        with open(TRADES_ACTIVE, 'w') as f:
-                            json.dump(cleaned_trades, f, indent=4, default=str)
-                        st.warning(f"⚠️ Очищено дополнительно {remaining_count} позиций")
-                    
-                    st.success(f"✅ Закрыто {len(active_trades)} позиций")
-                    st.rerun()
+                        # Без st.rerun: иначе предупреждение сразу исчезнет
+                        st.warning(
+                            f"⚠️ Закрыто {len(active_trades) - remaining_count} позиций, "
+                            f"не удалось закрыть {remaining_count}: {', '.join(remaining_trades)}"
+                        )
+                    else:
+                        st.success(f"✅ Закрыто {len(active_trades)} позиций")
+                        st.rerun()
                 except Exception as e:
                     st.error(f"❌ Ошибка закрытия позиций: {e}")
                     st.exception(e)
@@ -855,24 +1292,25 @@ def main():
                     st.error(f"❌ Ошибка: {e}")
     
     active_trades, history_trades = load_data()
+    # Типизированный DataFrame истории строится один раз (и кэшируется по mtime файла)
+    # и используется в KPI, кривой доходности и аналитике
+    df_history = load_history_df()
+    history_mtime = TRADES_HISTORY.stat().st_mtime if TRADES_HISTORY.exists() else 0
     
     # --- KPI Метрики ---
     total_trades = len(history_trades)
     
-    if total_trades > 0:
-        df_history = pd.DataFrame(history_trades)
-        
-        # Гарантируем числовой тип данных
-        if 'net_profit' in df_history.columns:
-            df_history['net_profit'] = pd.to_numeric(df_history['net_profit'], errors='coerce').fillna(0)
-            
-        total_pnl = df_history['net_profit'].sum()
-        wins = len(df_history[df_history['net_profit'] > 0])
+    if total_trades > 0 and not df_history.empty:
+        # Один проход по массиву P&L вместо нескольких фильтраций DataFrame
+        vals = df_history['net_profit'].to_numpy(dtype=float)
+        pos_mask = vals > 0
+        total_pnl = float(vals.sum())
+        wins = int(pos_mask.sum())
         win_rate = (wins / total_trades) * 100
-        avg_trade = df_history['net_profit'].mean()
+        avg_trade = float(vals.mean())
         
-        gross_profit = df_history[df_history['net_profit'] > 0]['net_profit'].sum()
-        gross_loss = abs(df_history[df_history['net_profit'] < 0]['net_profit'].sum())
+        gross_profit = float(vals[pos_mask].sum())
+        gross_loss = float(-vals[vals < 0].sum())
         
         if gross_loss > 0:
             profit_factor = gross_profit / gross_loss
@@ -895,32 +1333,33 @@ def main():
     
     if active_trades:
         # Сортируем активные позиции по времени входа, чтобы нумерация была хронологической и продолжала историю
-        sorted_active = sorted(active_trades.items(), key=lambda x: x[1].get('entry_time', ''))
         start_number = len(history_trades) + 1
+        active_tickers, active_labels = active_positions(active_trades_key(active_trades), start_number)
+        sorted_active = [(t, active_trades[t]) for t in active_tickers]
+        
+        # Таблица строится по колонкам, а не построчно
+        df_active = pd.DataFrame.from_records([{**data, 'ticker': t} for t, data in sorted_active])
+        if 'strategy_desc' not in df_active.columns:
+            df_active['strategy_desc'] = ''
         
-        active_list = []
-        for i, (t, data) in enumerate(sorted_active, start_number):
+        active_table = pd.DataFrame({
+            "№": np.arange(start_number, start_number + len(df_active)),
+            "Ticker": df_active['ticker'],
+            "Type": entry_mode_column(df_active),
+            "TF": df_active['strategy_desc'].fillna('').map(extract_timeframe),
+            "Dir": df_active['direction'],
+            "Entry": df_active['entry_price'],
+            "Lots": df_active['quantity_lots'],
+            "SL": df_active['stop_loss'],
+            "TP": df_active['take_profit'],
+            "Time": df_active['entry_time'].str.slice(5, 16), # MM-DD HH:MM
             # Если нет текущих данных MFE/MAE, ставим 0
-            mfe = data.get('mfe', 0)
-            mae = data.get('mae', 0)
-            
-            active_list.append({
-                "№": i,
-                "Ticker": t,
-                "Type": data.get('entry_mode', 'ema_squeeze' if 'EMA' in data.get('strategy_desc', '') or 'зажата' in data.get('strategy_desc', '') else 'Unknown'),
-                "TF": extract_timeframe(data.get('strategy_desc', '')),
-                "Dir": data['direction'],
-                "Entry": data['entry_price'],
-                "Lots": data['quantity_lots'],
-                "SL": data['stop_loss'],
-                "TP": data['take_profit'],
-                "Time": data['entry_time'][5:16], # MM-DD HH:MM
-                "MFE": f"{mfe:.2f}",
-                "MAE": f"{mae:.2f}",
-                "AI Prob": f"{data.get('ai_probability', 0):.1%}"
-            })
+            "MFE": format_number_column(df_active, 'mfe', '{:.2f}'),
+            "MAE": format_number_column(df_active, 'mae', '{:.2f}'),
+            "AI Prob": format_number_column(df_active, 'ai_probability', '{:.1%}')
+        })
         
-        st.dataframe(pd.DataFrame(active_list), use_container_width=True)
+        st.dataframe(active_table, use_container_width=True)
     else:
         st.info("Нет активных позиций")
         
@@ -936,47 +1375,46 @@ def main():
     # Вкладка 1: История сделок
     with tabs[tab_idx]:
         st.subheader("📜 История сделок")
-        if history_trades:
-            # Преобразуем для таблицы
-            history_display = []
-            total_history = len(history_trades)
-            for i, t in enumerate(reversed(history_trades)): # Новые сверху
-                history_display.append({
-                    "№": total_history - i,
-                    "Time": t['exit_time'][5:16], # MM-DD HH:MM
-                    "Ticker": t['ticker'],
-                    "Type": t.get('entry_mode', 'ema_squeeze' if 'EMA' in t.get('strategy_desc', '') or 'зажата' in t.get('strategy_desc', '') else 'Unknown'),
-                    "TF": extract_timeframe(t.get('strategy_desc', '')),
-                    "Dir": t['direction'],
-                    "P&L": f"{t['net_profit']:.2f}",
-                    "Reason": t['close_reason'],
-                    "MFE": f"{t.get('mfe', 0):.2f}",
-                    "MAE": f"{t.get('mae', 0):.2f}",
-                    "AI Prob": f"{t.get('ai_probability', 0):.1%}"
-                })
-                
-            df_display = pd.DataFrame(history_display)
+        if history_trades and not df_history.empty:
+            # Таблица строится по колонкам из кэшированного df_history, новые сверху
+            history_rev = df_history.iloc[::-1]
+            total_history = len(history_rev)
+            # Подсветка P&L эмодзи прямо в строке (без Styler, который рендерит всю таблицу в HTML)
+            pnl_marks = np.where(history_rev['net_profit'].to_numpy() > 0, '🟢 ', '🔴 ')
+            df_display = pd.DataFrame({
+                "№": np.arange(total_history, 0, -1),
+                "Time": history_rev['exit_label'].to_numpy(), # MM-DD HH:MM
+                "Ticker": history_rev['ticker'].to_numpy(),
+                "Type": history_rev['entry_mode'].to_numpy(),
+                "TF": history_rev['timeframe'].to_numpy(),
+                "Dir": history_rev['direction'].to_numpy(),
+                "P&L": pnl_marks + format_number_column(history_rev, 'net_profit', '{:.2f}').to_numpy(dtype=object),
+                "Reason": history_rev['close_reason'].to_numpy(),
+                "MFE": format_number_column(history_rev, 'mfe', '{:.2f}').to_numpy(),
+                "MAE": format_number_column(history_rev, 'mae', '{:.2f}').to_numpy(),
+                "AI Prob": format_number_column(history_rev, 'ai_probability', '{:.1%}').to_numpy()
+            })
             
-            # Подсветка P&L
-            def highlight_pnl(val):
-                try:
-                    v = float(val)
-                    color = 'green' if v > 0 else 'red'
-                    return f'color: {color}'
-                except:
-                    return ''
-
-            st.dataframe(df_display.style.applymap(highlight_pnl, subset=['P&L']), use_container_width=True)
+            st.dataframe(df_display, use_container_width=True, hide_index=True)
             
             # --- ВИЗУАЛИЗАЦИЯ СДЕЛКИ ---
             st.divider()
             st.subheader("📊 Визуализация сделки")
         
-            # Выбор сделки для визуализации
-            trade_options = []
+            # Выбор сделки для визуализации: список строится только по текущей странице (новые сверху)
             total_history = len(history_trades)
-            for i, t in enumerate(reversed(history_trades)):
-                trade_num = total_history - i
+            total_pages = max(1, -(-total_history // HISTORY_PAGE_SIZE))
+            page = 1
+            if total_pages > 1:
+                page = int(st.number_input("Страница (новые сверху):", min_value=1, max_value=total_pages,
+                                           value=1, step=1, key='trade_page'))
+            page_end = total_history - (page - 1) * HISTORY_PAGE_SIZE
+            page_start = max(0, page_end - HISTORY_PAGE_SIZE)
+            visible_trades = history_trades[page_start:page_end][::-1]
+            
+            trade_options = []
+            for i, t in enumerate(visible_trades):
+                trade_num = page_end - i
                 pnl = t['net_profit']
                 pnl_sign = "✅" if pnl > 0 else "❌"
                 timeframe = extract_timeframe(t.get('strategy_desc', ''))
@@ -992,7 +1430,7 @@ def main():
                     )
                     
                     if selected_trade_idx is not None:
-                        selected_trade = list(reversed(history_trades))[selected_trade_idx]
+                        selected_trade = visible_trades[selected_trade_idx]
                         
                         # Загружаем snapshot свечей
                         snapshot_file = selected_trade.get('snapshot_file', '')
@@ -1004,13 +1442,11 @@ def main():
                         
                         if snapshot_path and snapshot_path.exists():
                             try:
-                                df_snapshot = pd.read_csv(snapshot_path)
-                                
-                                # Загружаем паттерн
+                                # Загружаем паттерн (если сохранен)
                                 pattern_info = None
-                                if pattern_path and pattern_path.exists():
-                                    with open(pattern_path, 'r') as f:
-                                        pattern_info = json.load(f)
+                                has_pattern = bool(pattern_path and pattern_path.exists())
+                                if has_pattern:
+                                    pattern_info = load_pattern(str(pattern_path), pattern_path.stat().st_mtime)
                                 
                                 # Создаем график
                                 trade_data = {
@@ -1022,7 +1458,12 @@ def main():
                                     'exit_time': selected_trade.get('exit_time')
                                 }
                                 
-                                fig = create_trade_chart(df_snapshot, pattern_info, trade_data)
+                                fig = history_trade_chart(
+                                    str(snapshot_path), snapshot_path.stat().st_mtime,
+                                    str(pattern_path) if has_pattern else None,
+                                    pattern_path.stat().st_mtime if has_pattern else 0,
+                                    trade_data
+                                )
                                 
                                 # Информация о сделке
                                 qty = int(selected_trade.get('quantity_lots', 1))
@@ -1071,18 +1512,8 @@ def main():
         # Вкладка 2: Кривая доходности
         with tabs[tab_idx]:
             st.subheader("📈 Кривая доходности")
-            if history_trades and total_trades > 0:
-                df_history = pd.DataFrame(history_trades)
-                df_history['exit_time'] = pd.to_datetime(df_history['exit_time'], utc=True, errors='coerce')
-                df_history = df_history.sort_values('exit_time')
-                df_history['cumulative_pnl'] = df_history['net_profit'].cumsum()
-                
-                fig = px.line(df_history, x='exit_time', y='cumulative_pnl', markers=True)
-                fig.update_layout(
-                    xaxis_title="Дата и время",
-                    yaxis_title="P&L (RUB)",
-                    xaxis=dict(tickformat='%d.%m.%Y %H:%M')
-                )
+            if history_trades and not df_history.empty:
+                fig = equity_curve_fig(df_history, history_mtime)
                 st.plotly_chart(fig, use_container_width=True, width='stretch')
             else:
                 st.info("Нет данных для построения графика доходности")
@@ -1091,55 +1522,11 @@ def main():
 
         # Вкладка 3: Аналитика
         with tabs[tab_idx]:
-            if history_trades:
+            if history_trades and not df_history.empty:
                 st.subheader("📊 Анализ совершенных сделок")
                 
-                df_analysis = pd.DataFrame(history_trades)
-                df_analysis['net_profit'] = pd.to_numeric(df_analysis['net_profit'], errors='coerce').fillna(0)
-                df_analysis['entry_time'] = pd.to_datetime(df_analysis['entry_time'], format='ISO8601', errors='coerce')
-                df_analysis['exit_time'] = pd.to_datetime(df_analysis['exit_time'], format='ISO8601', errors='coerce')
-                
-                # Убираем timezone для корректного вычитания (универсальный метод)
-                # Используем более надежный подход - преобразуем через pd.to_datetime с utc=False
-                if pd.api.types.is_datetime64_any_dtype(df_analysis['entry_time']):
-                    # Преобразуем в naive datetime, удаляя timezone
-                    try:
-                        # Пробуем через dt.tz_convert если есть timezone
-                        if df_analysis['entry_time'].dt.tz is not None:
-                            df_analysis['entry_time'] = df_analysis['entry_time'].dt.tz_convert(None)
-                    except:
-                        pass
-                    # Дополнительная проверка через apply для каждого элемента
-                    df_analysis['entry_time'] = df_analysis['entry_time'].apply(
-                        lambda x: x.replace(tzinfo=None) if x is not None and pd.notna(x) and hasattr(x, 'tzinfo') and x.tzinfo is not None else x
-                    )
-                    # Финальное преобразование через pd.to_datetime для гарантии
-                    df_analysis['entry_time'] = pd.to_datetime(df_analysis['entry_time'], errors='coerce')
-                
-                if pd.api.types.is_datetime64_any_dtype(df_analysis['exit_time']):
-                    try:
-                        if df_analysis['exit_time'].dt.tz is not None:
-                            df_analysis['exit_time'] = df_analysis['exit_time'].dt.tz_convert(None)
-                    except:
-                        pass
-                    df_analysis['exit_time'] = df_analysis['exit_time'].apply(
-                        lambda x: x.replace(tzinfo=None) if x is not None and pd.notna(x) and hasattr(x, 'tzinfo') and x.tzinfo is not None else x
-                    )
-                    df_analysis['exit_time'] = pd.to_datetime(df_analysis['exit_time'], errors='coerce')
-                
-                # Вычисляем время удержания только для валидных datetime
-                valid_times = df_analysis['entry_time'].notna() & df_analysis['exit_time'].notna()
-                df_analysis['hold_time_hours'] = None
-                if valid_times.any():
-                    # Используем преобразование в UTC для гарантированного вычитания
-                    entry_s = pd.to_datetime(df_analysis.loc[valid_times, 'entry_time'], utc=True)
-                    exit_s = pd.to_datetime(df_analysis.loc[valid_times, 'exit_time'], utc=True)
-                    
-                    # Вычисляем разницу
-                    time_diff = exit_s - entry_s
-                    # Конвертируем в часы
-                    df_analysis.loc[valid_times, 'hold_time_hours'] = time_diff.dt.total_seconds() / 3600
-                df_analysis['timeframe'] = df_analysis['strategy_desc'].apply(extract_timeframe)
+                # Колонки времени, hold_time_hours, timeframe и entry_mode уже подготовлены в build_history_df
+                df_analysis = df_history.copy()
                 
                 # Основные метрики
                 col1, col2, col3, col4 = st.columns(4)
@@ -1147,79 +1534,58 @@ def main():
                     total_trades_count = len(df_analysis)
                     st.metric("Всего сделок", total_trades_count)
                 with col2:
-                    wins = len(df_analysis[df_analysis['net_profit'] > 0])
+                    wins = int((df_analysis['net_profit'].to_numpy() > 0).sum())
                     win_rate = (wins / total_trades_count * 100) if total_trades_count > 0 else 0
                     st.metric("Прибыльных", f"{wins} ({win_rate:.1f}%)")
                 with col3:
                     avg_profit = df_analysis['net_profit'].mean()
                     st.metric("Средний P&L", f"{avg_profit:.2f} ₽")
                 with col4:
-                    total_commission = df_analysis.get('commission_total', pd.Series([0] * len(df_analysis))).sum()
+                    total_commission = float(df_analysis['commission_total'].sum()) if 'commission_total' in df_analysis.columns else 0.0
                     st.metric("Комиссии", f"{total_commission:.2f} ₽")
                 
+                # Все разрезы считаются одной спецификацией агрегации по категориальным колонкам
+                # (category задается в build_history_df); TP-закрытия - сумма булевой колонки вместо lambda
+                df_analysis['is_tp'] = df_analysis['close_reason'] == 'TAKE PROFIT'
+                group_cols = ['direction', 'close_reason', 'ticker', 'entry_mode']
+                agg_spec = {'net_profit': ['count', 'sum', 'mean'], 'is_tp': 'sum'}
+                group_stats = {
+                    col: df_analysis.groupby(col, observed=True).agg(agg_spec).round(2)
+                    for col in group_cols
+                }
+                
                 # Анализ по направлениям
                 st.write("**📈 Анализ по направлениям:**")
-                direction_stats = df_analysis.groupby('direction').agg({
-                    'net_profit': ['count', 'sum', 'mean'],
-                    'close_reason': lambda x: (x == 'TAKE PROFIT').sum()
-                }).round(2)
+                direction_stats = group_stats['direction']
                 direction_stats.columns = ['Сделок', 'Общий P&L', 'Средний P&L', 'TP закрытий']
                 st.dataframe(direction_stats, use_container_width=True)
                 
                 # Анализ по причинам закрытия
                 st.write("**🎯 Анализ по причинам закрытия:**")
-                reason_stats = df_analysis.groupby('close_reason').agg({
-                    'net_profit': ['count', 'sum', 'mean']
-                }).round(2)
+                reason_stats = group_stats['close_reason'].iloc[:, :3]
                 reason_stats.columns = ['Количество', 'Общий P&L', 'Средний P&L']
                 st.dataframe(reason_stats, use_container_width=True)
                 
                 # Анализ по тикерам
                 st.write("**🏷️ Топ-5 тикеров по количеству сделок:**")
-                ticker_stats = df_analysis.groupby('ticker').agg({
-                    'net_profit': ['count', 'sum', 'mean']
-                }).round(2)
+                ticker_stats = group_stats['ticker'].iloc[:, :3]
                 ticker_stats.columns = ['Сделок', 'Общий P&L', 'Средний P&L']
                 ticker_stats = ticker_stats.sort_values('Сделок', ascending=False).head(5)
                 st.dataframe(ticker_stats, use_container_width=True)
                 
                 # Анализ по типам стратегии (entry_mode)
                 st.write("**🧠 Анализ по типу входа (Entry Mode):**")
-                # Проверяем, есть ли колонка entry_mode, если нет - создаем из strategy_desc
-                if 'entry_mode' not in df_analysis.columns:
-                     df_analysis['entry_mode'] = df_analysis['strategy_desc'].apply(
-                         lambda x: 'ema_squeeze' if x and ('EMA' in x or 'зажата' in x) else 'Unknown'
-                     )
-                else:
-                     # Заполняем пропуски для старых сделок
-                     mask_unknown = df_analysis['entry_mode'].isna() | (df_analysis['entry_mode'] == 'Unknown')
-                     if mask_unknown.any():
-                         df_analysis.loc[mask_unknown, 'entry_mode'] = df_analysis.loc[mask_unknown, 'strategy_desc'].apply(
-                             lambda x: 'ema_squeeze' if x and ('EMA' in x or 'зажата' in x) else 'Unknown'
-                         )
-                     
-                mode_stats = df_analysis.groupby('entry_mode').agg({
-                    'net_profit': ['count', 'sum', 'mean'],
-                    'close_reason': lambda x: (x == 'TAKE PROFIT').sum()
-                }).round(2)
+                mode_stats = group_stats['entry_mode']
                 mode_stats.columns = ['Сделок', 'Общий P&L', 'Средний P&L', 'TP закрытий']
                 st.dataframe(mode_stats, use_container_width=True)
                 
                 # Визуализация распределения P&L
+                fig_hist, fig_hold = analytics_figs(df_history, history_mtime)
                 col_chart1, col_chart2 = st.columns(2)
                 with col_chart1:
-                    fig_hist = px.histogram(df_analysis, x='net_profit', nbins=20, 
-                                           title='Распределение P&L по сделкам',
-                                           labels={'net_profit': 'P&L (₽)', 'count': 'Количество'})
-                    fig_hist.add_vline(x=0, line_dash="dash", line_color="red", 
-                                      annotation_text="Безубыток")
                     st.plotly_chart(fig_hist, use_container_width=True)
                 
                 with col_chart2:
-                    # Время удержания позиций
-                    fig_hold = px.box(df_analysis, y='hold_time_hours', 
-                                     title='Время удержания позиций (часы)',
-                                     labels={'hold_time_hours': 'Часы'})
                     st.plotly_chart(fig_hold, use_container_width=True)
                 
                 # Выводы и рекомендации
@@ -1232,8 +1598,10 @@ def main():
                 if avg_profit < 0:
                     conclusions.append(f"⚠️ **Средний P&L отрицательный ({avg_profit:.2f} ₽)** - стратегия в текущем виде убыточна. Необходима оптимизация параметров.")
                 
-                tp_closes = len(df_analysis[df_analysis['close_reason'] == 'TAKE PROFIT'])
-                sl_closes = len(df_analysis[df_analysis['close_reason'] == 'STOP LOSS'])
+                # Один проход по колонке вместо двух фильтраций DataFrame
+                reason_counts = df_analysis['close_reason'].value_counts()
+                tp_closes = int(reason_counts.get('TAKE PROFIT', 0))
+                sl_closes = int(reason_counts.get('STOP LOSS', 0))
                 if sl_closes > tp_closes * 2:
                     conclusions.append(f"⚠️ **Дисбаланс выходов** - {sl_closes} закрытий по SL vs {tp_closes} по TP. Возможно, стопы слишком близко или тейки слишком далеко.")
                 
@@ -1243,13 +1611,14 @@ def main():
                     conclusions.append(f"⚠️ **Высокие комиссии** - средняя комиссия ({avg_commission:.2f} ₽) составляет значительную долю от среднего P&L. Рассмотрите увеличение размера позиций или снижение частоты сделок.")
                 
                 # Проверка AI фильтра
-                if df_analysis['ai_probability'].sum() == 0:
+                ai_active = bool(df_analysis['ai_probability'].fillna(0).to_numpy().any())
+                if not ai_active:
                     conclusions.append("ℹ️ **AI фильтр не активен** - все сделки имеют вероятность 0.0. Проверьте, загружена ли ML модель и работает ли фильтрация.")
                 
                 # Анализ по таймфреймам
-                if 'timeframe' in df_analysis.columns:
-                    tf_stats = df_analysis.groupby('timeframe')['net_profit'].agg(['count', 'sum', 'mean']).round(2)
-                    tf_stats.columns = ['Сделок', 'Общий P&L', 'Средний P&L']
+                tf_profit = profit_by_group(df_analysis, 'timeframe') if 'timeframe' in df_analysis.columns else None
+                if tf_profit is not None:
+                    tf_stats = tf_profit.set_axis(['Сделок', 'Общий P&L', 'Средний P&L'], axis=1)
                     if len(tf_stats) > 0:
                         best_tf = tf_stats['Средний P&L'].idxmax()
                         conclusions.append(f"📊 **Лучший таймфрейм** - {best_tf} (средний P&L: {tf_stats.loc[best_tf, 'Средний P&L']:.2f} ₽)")
@@ -1263,12 +1632,24 @@ def main():
                 # Дополнительная статистика
                 with st.expander("📈 Детальная статистика"):
                     st.write("**Распределение по таймфреймам:**")
-                    if 'timeframe' in df_analysis.columns:
-                        st.dataframe(df_analysis.groupby('timeframe')['net_profit'].agg(['count', 'sum', 'mean']).round(2), 
-                                   use_container_width=True)
+                    if tf_profit is not None:
+                        st.dataframe(tf_profit, use_container_width=True)
                     
                     st.write("**Статистика MFE/MAE:**")
-                    mfe_mae_stats = df_analysis[['mfe', 'mae']].describe()
+                    # Те же строки, что у describe(), но сразу по numpy-массиву (пропуски не учитываются)
+                    mfe_mae = df_analysis[['mfe', 'mae']].to_numpy(dtype=float)
+                    mfe_mae_stats = pd.DataFrame(
+                        np.vstack([
+                            (~np.isnan(mfe_mae)).sum(axis=0),
+                            np.nanmean(mfe_mae, axis=0),
+                            np.nanstd(mfe_mae, axis=0, ddof=1),
+                            np.nanmin(mfe_mae, axis=0),
+                            np.nanpercentile(mfe_mae, [25, 50, 75], axis=0),
+                            np.nanmax(mfe_mae, axis=0),
+                        ]),
+                        index=['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max'],
+                        columns=['mfe', 'mae']
+                    )
                     st.dataframe(mfe_mae_stats, use_container_width=True)
             else:
                 st.info("Нет данных для анализа")
@@ -1281,8 +1662,7 @@ def main():
             
             if history_trades:
                 try:
-                    from trading_bot.pattern_tracker import PatternTracker
-                    pattern_tracker = PatternTracker()
+                    pattern_tracker = get_pattern_tracker()
                     
                     # Получаем список всех тикеров/таймфреймов с историей
                     all_keys = list(pattern_tracker.pattern_history.keys())
@@ -1298,7 +1678,7 @@ def main():
                         
                         if selected_key:
                             ticker, tf = selected_key.split('_', 1)
-                            history = pattern_tracker.get_pattern_history(ticker, tf, limit=20)
+                            history = get_pattern_history(ticker, tf, limit=20)
                             
                             if history:
                                 # Статистика перерисовок
@@ -1314,24 +1694,19 @@ def main():
                                 with col_stat3:
                                     st.metric("Процент перерисовки", f"{repaint_rate:.1f}%")
                                 
-                                # Таблица истории
-                                history_display = []
-                                for i, record in enumerate(reversed(history[-20:]), 1):  # Последние 20
-                                    pattern = record['pattern']
-                                    t4 = pattern.get('t4', {})
-                                    
-                                    history_display.append({
-                                        "№": len(history) - i + 1,
-                                        "Время T4": record.get('t4_time', '')[:16] if record.get('t4_time') else 'N/A',
-                                        "T0": f"{pattern.get('t0', {}).get('idx', 0)}",
-                                        "T1": f"{pattern.get('t1', {}).get('idx', 0)}",
-                                        "T4": f"{t4.get('idx', 0)}",
-                                        "Перерисован": "✅ Да" if record.get('is_repaint') else "❌ Нет",
-                                        "Подпись": (record.get('signature', '') or '')[:8] + "..."
-                                    })
-                                
-                                df_history = pd.DataFrame(history_display)
-                                st.dataframe(df_history, use_container_width=True)
+                                # Таблица истории (по колонкам, последние 20 - сверху)
+                                records = history[:-21:-1]  # одним срезом: последние 20 в обратном порядке
+                                patterns = [r['pattern'] for r in records]
+                                df_repaints = pd.DataFrame({
+                                    "№": np.arange(len(history), len(history) - len(records), -1),
+                                    "Время T4": [r['t4_time'][:16] if r.get('t4_time') else 'N/A' for r in records],
+                                    "T0": [str(p.get('t0', {}).get('idx', 0)) for p in patterns],
+                                    "T1": [str(p.get('t1', {}).get('idx', 0)) for p in patterns],
+                                    "T4": [str(p.get('t4', {}).get('idx', 0)) for p in patterns],
+                                    "Перерисован": ["✅ Да" if r.get('is_repaint') else "❌ Нет" for r in records],
+                                    "Подпись": [(r.get('signature', '') or '')[:8] + "..." for r in records],
+                                })
+                                st.dataframe(df_repaints, use_container_width=True)
                             else:
                                 st.info("Нет истории паттернов для выбранного инструмента")
                     else:
@@ -1348,22 +1723,9 @@ def main():
             if active_trades:
                 st.subheader("📊 Визуализация активной позиции")
                 
-                # Сортируем активные позиции по времени входа (как в таблице)
-                # Это обеспечивает порядковую нумерацию, продолжающую историю
-                sorted_active = sorted(active_trades.items(), key=lambda x: x[1].get('entry_time', ''))
-                start_number = len(history_trades) + 1
-                
-                # Выбор активной позиции с порядковым номером
-                active_options = []
-                ticker_list = []  # Сохраняем соответствие между индексом и тикером
-                
-                for i, (ticker, data) in enumerate(sorted_active, start_number):
-                    entry_time_str = data.get('entry_time', '')
-                    entry_time_short = entry_time_str[11:19] if len(entry_time_str) > 19 else entry_time_str
-                    timeframe = extract_timeframe(data.get('strategy_desc', ''))
-                    timeframe_str = f"[{timeframe}]" if timeframe != "N/A" else ""
-                    active_options.append(f"#{i}: {ticker} ({data['direction']}) {timeframe_str} - {entry_time_short}")
-                    ticker_list.append(ticker)
+                # Выбор активной позиции: порядок по времени входа и нумерация, продолжающая историю,
+                # те же, что в таблице выше (active_positions)
+                ticker_list, active_options = active_tickers, active_labels
                 
                 selected_active_idx = st.selectbox(
                     "Выберите активную позицию:",
@@ -1388,8 +1750,8 @@ def main():
                     pattern_info = None
                     if pattern_path and pattern_path.exists():
                         try:
-                            with open(pattern_path, 'r') as f:
-                                pattern_info = json.load(f)
+                            # cache_data отдает копию, поэтому корректировка idx ниже не портит кэш
+                            pattern_info = load_pattern(str(pattern_path), pattern_path.stat().st_mtime)
                             st.success(f"✅ Паттерн загружен из {pattern_path.name}")
                         except Exception as e:
                             st.warning(f"⚠️ Ошибка загрузки паттерна: {e}")
@@ -1402,12 +1764,15 @@ def main():
                     if snapshot_path and snapshot_path.exists():
                         try:
                             # Загружаем snapshot для паттерна
-                            df_snapshot = pd.read_csv(snapshot_path)
+                            df_snapshot = load_snapshot(str(snapshot_path), snapshot_path.stat().st_mtime)
                             
                             # Для активных позиций загружаем актуальные свечи
                             use_live_data = st.checkbox("📊 Показать актуальные данные", value=True, key=f"live_data_{selected_ticker}")
                             
-                            df_live = pd.DataFrame()  # Инициализируем пустым
+                            # По умолчанию рисуем только snapshot; live-ветка ниже подменяет его объединенными данными.
+                            # Время входа, TIMEFRAMES и запрос свечей нужны только при включенных live-данных
+                            df_to_plot = df_snapshot
+                            df_live = pd.DataFrame()
                             current_price = None
                             current_pnl = selected_trade.get('mfe', 0)
                             
@@ -1416,15 +1781,8 @@ def main():
                                 strategy_desc = selected_trade.get('strategy_desc', '')
                                 timeframe = extract_timeframe(strategy_desc)
                                 
-                                # Определяем интервал свечей на основе таймфрейма
-                                from config import TIMEFRAMES
-                                if timeframe in TIMEFRAMES:
-                                    candle_interval = TIMEFRAMES[timeframe]['interval']
-                                    days_back = TIMEFRAMES[timeframe]['days_back']
-                                else:
-                                    # По умолчанию используем часовой интервал
-                                    candle_interval = CandleInterval.CANDLE_INTERVAL_HOUR
-                                    days_back = 60
+                                # Определяем интервал свечей на основе таймфрейма (по умолчанию - часовой)
+                                interval_name, days_back = timeframe_settings(timeframe)
                                 
                                 entry_time = pd.to_datetime(selected_trade.get('entry_time', datetime.now() - timedelta(days=days_back)))
                                 # Убираем timezone для корректного сравнения
@@ -1459,7 +1817,15 @@ def main():
                                     # Загружаем свежие свечи с момента входа (или за последние days_back дней)
                                     from_date = max(entry_time, datetime.now() - timedelta(days=days_back))
                                 
-                                df_live = get_current_candles(selected_ticker, class_code, from_date, candle_interval)
+                                try:
+                                    df_live = cached_current_candles(
+                                        selected_ticker, class_code,
+                                        pd.Timestamp(from_date).floor('h'),
+                                        interval_name
+                                    )
+                                except Exception as e:
+                                    st.error(f"Ошибка загрузки свечей для {selected_ticker}: {e}")
+                                    df_live = pd.DataFrame()
                                 
                                 if not df_live.empty:
                                     # Убеждаемся, что колонка time есть и в правильном формате
@@ -1478,94 +1844,86 @@ def main():
                                             start_time = entry_time - timedelta(hours=len(df_snapshot))
                                         df_snapshot['time'] = pd.date_range(start=start_time, periods=len(df_snapshot), freq=freq)
                                     
-                                    # Преобразуем time в datetime для обоих датафреймов и нормализуем timezone
-                                    df_snapshot['time'] = pd.to_datetime(df_snapshot['time'], format='ISO8601', errors='coerce')
-                                    if df_snapshot['time'].dt.tz is not None:
-                                        df_snapshot['time'] = df_snapshot['time'].dt.tz_localize(None)
+                                    # Преобразуем time в naive UTC для обоих датафреймов (один проход на колонку)
+                                    df_snapshot['time'] = _to_naive_utc(df_snapshot['time'])
+                                    df_live['time'] = _to_naive_utc(df_live['time'])
                                     
-                                    df_live['time'] = pd.to_datetime(df_live['time'], format='ISO8601', errors='coerce')
-                                    if df_live['time'].dt.tz is not None:
-                                        df_live['time'] = df_live['time'].dt.tz_localize(None)
+                                    # Объединяем snapshot и live данные: свечи snapshot, время которых есть в live,
+                                    # отбрасываем (live данные имеют приоритет), остальные ставим перед live
+                                    keep_snapshot = ~np.isin(df_snapshot['time'].to_numpy(), df_live['time'].to_numpy())
+                                    df_combined = pd.concat([df_snapshot[keep_snapshot], df_live], ignore_index=True)
                                     
-                                    # Объединяем snapshot и live данные
-                                    # Берем все snapshot данные и добавляем live данные
-                                    df_combined = pd.concat([df_snapshot, df_live], ignore_index=True)
-                                    
-                                    # Удаляем дубликаты по времени, оставляя последние (live данные имеют приоритет)
-                                    df_combined = df_combined.drop_duplicates(subset=['time'], keep='last')
-                                    
-                                    # Сортируем по времени для правильного отображения свечей
-                                    df_combined = df_combined.sort_values('time').reset_index(drop=True)
+                                    # Оба набора уже отсортированы по времени; пересортировка нужна, только если
+                                    # snapshot заходит внутрь периода live-свечей (например, пропуски в live)
+                                    if not df_combined['time'].is_monotonic_increasing:
+                                        df_combined = df_combined.sort_values('time', kind='stable').reset_index(drop=True)
                                     
                                     # КОРРЕКТИРОВКА ИНДЕКСОВ ПАТТЕРНА:
                                     # Индексы паттерна были относительно df_snapshot, но теперь нужно найти
                                     # соответствующие индексы в df_combined по времени
                                     if pattern_info and 'time' in df_combined.columns:
-                                        # Используем время из паттерна для точного сопоставления
-                                        for point_key in ['t0', 't1', 't2', 't3', 't4']:
-                                            if point_key in pattern_info and 'time' in pattern_info[point_key]:
-                                                pattern_time_str = pattern_info[point_key]['time']
-                                                try:
-                                                    # Преобразуем время паттерна в datetime
-                                                    pattern_time = pd.to_datetime(pattern_time_str)
-                                                    if pattern_time.tzinfo is not None:
-                                                        pattern_time = pattern_time.replace(tzinfo=None)
-                                                    
-                                                    # Находим ближайшую свечу в df_combined по времени
-                                                    time_diffs = abs(df_combined['time'] - pattern_time)
-                                                    closest_idx = time_diffs.idxmin()
-                                                    
-                                                    # Проверяем, что разница во времени не слишком большая (например, не более 1 дня)
-                                                    min_diff = time_diffs.min()
-                                                    if min_diff < pd.Timedelta(days=1):
+                                        point_keys = ['t0', 't1', 't2', 't3', 't4']
+                                        # Точки со временем сопоставляем одним векторным поиском
+                                        # по отсортированному df_combined
+                                        timed_keys = [k for k in point_keys if k in pattern_info and 'time' in pattern_info[k]]
+                                        if timed_keys:
+                                            try:
+                                                # Преобразуем времена паттерна в naive UTC (как и свечи) одним вызовом
+                                                pattern_times = _to_naive_utc(pd.Series([pattern_info[k]['time'] for k in timed_keys]))
+                                                
+                                                # Находим ближайшие свечи в df_combined по времени
+                                                closest_idxs, min_diffs = _nearest_sorted_time_indices(
+                                                    df_combined['time'].to_numpy(), pattern_times.to_numpy()
+                                                )
+                                                # Проверяем, что разница во времени не слишком большая (не более 1 дня)
+                                                found = min_diffs < np.timedelta64(1, 'D')
+                                                for point_key, closest_idx, min_diff, ok in zip(timed_keys, closest_idxs, min_diffs, found):
+                                                    if ok:
                                                         # Обновляем индекс в pattern_info
                                                         pattern_info[point_key]['idx'] = int(closest_idx)
                                                     else:
-                                                        st.warning(f"⚠️ Не найдена свеча для {point_key} (время: {pattern_time_str}, минимальная разница: {min_diff})")
-                                                except Exception as e:
-                                                    st.warning(f"⚠️ Ошибка сопоставления времени для {point_key}: {e}")
-                                            elif point_key in pattern_info and 'idx' in pattern_info[point_key]:
-                                                # Если нет времени, используем старый метод (смещение)
-                                                snapshot_first_time = df_snapshot['time'].iloc[0] if not df_snapshot.empty and 'time' in df_snapshot.columns else None
-                                                if snapshot_first_time is not None:
-                                                    matching_indices = df_combined[df_combined['time'] == snapshot_first_time].index
-                                                    if len(matching_indices) > 0:
-                                                        snapshot_start_idx = matching_indices[0]
-                                                        old_idx = int(pattern_info[point_key]['idx'])
-                                                        new_idx = snapshot_start_idx + old_idx
-                                                        if 0 <= new_idx < len(df_combined):
-                                                            pattern_info[point_key]['idx'] = new_idx
+                                                        st.warning(f"⚠️ Не найдена свеча для {point_key} (время: {pattern_info[point_key]['time']}, минимальная разница: {pd.Timedelta(min_diff)})")
+                                            except Exception as e:
+                                                st.warning(f"⚠️ Ошибка сопоставления времени паттерна: {e}")
+                                        
+                                        # Если у точки нет времени, используем старый метод (смещение)
+                                        for point_key in point_keys:
+                                            if point_key in timed_keys or point_key not in pattern_info or 'idx' not in pattern_info[point_key]:
+                                                continue
+                                            snapshot_first_time = df_snapshot['time'].iloc[0] if not df_snapshot.empty and 'time' in df_snapshot.columns else None
+                                            if snapshot_first_time is not None:
+                                                matching_indices = df_combined[df_combined['time'] == snapshot_first_time].index
+                                                if len(matching_indices) > 0:
+                                                    snapshot_start_idx = matching_indices[0]
+                                                    old_idx = int(pattern_info[point_key]['idx'])
+                                                    new_idx = snapshot_start_idx + old_idx
+                                                    if 0 <= new_idx < len(df_combined):
+                                                        pattern_info[point_key]['idx'] = new_idx
                                     
                                     # Убеждаемся, что все необходимые колонки есть и в правильном формате
                                     required_cols = ['open', 'high', 'low', 'close']
                                     for col in required_cols:
                                         if col not in df_combined.columns:
                                             st.warning(f"⚠️ Отсутствует колонка {col} в данных")
-                                        elif df_combined[col].isna().any():
-                                            # Заполняем пропущенные значения предыдущими значениями
-                                            df_combined[col] = df_combined[col].fillna(method='ffill').fillna(method='bfill')
+                                    # Заполняем пропущенные значения предыдущими (затем следующими) одним блоком
+                                    ohlc_cols = [col for col in required_cols if col in df_combined.columns]
+                                    if df_combined[ohlc_cols].isna().to_numpy().any():
+                                        df_combined[ohlc_cols] = df_combined[ohlc_cols].ffill().bfill()
                                     
                                     # Убеждаемся, что high >= max(open, close) и low <= min(open, close)
-                                    df_combined['high'] = df_combined[['high', 'open', 'close']].max(axis=1)
-                                    df_combined['low'] = df_combined[['low', 'open', 'close']].min(axis=1)
+                                    # (поэлементно на массивах; fmax/fmin пропускают NaN, как max/min по строкам)
+                                    o = df_combined['open'].to_numpy(dtype=float)
+                                    c = df_combined['close'].to_numpy(dtype=float)
+                                    df_combined['high'] = np.fmax(df_combined['high'].to_numpy(dtype=float), np.fmax(o, c))
+                                    df_combined['low'] = np.fmin(df_combined['low'].to_numpy(dtype=float), np.fmin(o, c))
                                     
-                                    # Вычисляем текущий P&L
-                                    current_price = df_live.iloc[-1]['close']
-                                    entry_price = selected_trade.get('entry_price')
+                                    # Вычисляем текущий P&L (скаляры Python, без индексаторов pandas)
+                                    current_price = float(df_live['close'].to_numpy()[-1])
+                                    entry_price = float(selected_trade.get('entry_price') or 0.0)
                                     direction = selected_trade.get('direction', 'LONG')
-                                    
-                                    if direction == 'LONG':
-                                        current_pnl = current_price - entry_price
-                                    else:
-                                        current_pnl = entry_price - current_price
+                                    current_pnl = (current_price - entry_price) if direction == 'LONG' else (entry_price - current_price)
                                     
                                     df_to_plot = df_combined
-                                else:
-                                    df_to_plot = df_snapshot
-                                    current_pnl = selected_trade.get('mfe', 0)
-                            else:
-                                df_to_plot = df_snapshot
-                                current_pnl = selected_trade.get('mfe', 0)
                             
                             # Создаем график (без exit_price, так как позиция еще открыта)
                             trade_data = {
@@ -1576,7 +1934,9 @@ def main():
                                 'entry_time': selected_trade.get('entry_time')
                             }
                             
-                            fig = create_trade_chart(df_to_plot, pattern_info, trade_data)
+                            # Длинную историю прореживаем (точки паттерна, первая и последняя свечи остаются)
+                            df_to_plot = downsample_chart_data(df_to_plot, pattern_info)
+                            fig = cached_trade_chart(df_to_plot, pattern_info, trade_data)
                             
                             # Добавляем текущую цену на график, если используем live данные
                             if use_live_data and not df_live.empty and current_price is not None:
@@ -1591,35 +1951,25 @@ def main():
                                         current_x = current_idx
                                 else:
                                     current_x = current_idx
-                                fig.add_trace(go.Scatter(
-                                    x=[current_x],
-                                    y=[current_price],
-                                    mode='markers+text',
-                                    marker=dict(size=15, color='orange', symbol='star', line=dict(width=2, color='white')),
-                                    text=['CURRENT'],
-                                    textposition='top center',
-                                    name='Текущая цена',
-                                    showlegend=True,
-                                    hovertemplate=f'<b>ТЕКУЩАЯ ЦЕНА</b><br>Цена: {current_price:.2f}<br>P&L: {current_pnl:.2f}<extra></extra>'
-                                ), row=1, col=1)
+                                fig.add_trace(current_price_marker(current_x, current_price, current_pnl), row=1, col=1)
                             
-                            # Информация о позиции
-                            col1, col2, col3 = st.columns(3)
-                            with col1:
-                                if use_live_data and not df_live.empty:
-                                    st.metric("Текущий P&L", f"{current_pnl:.2f} ₽", 
-                                            delta=f"MFE: {selected_trade.get('mfe', 0):.2f}")
-                                else:
-                                    st.metric("Текущий P&L", f"{selected_trade.get('mfe', 0):.2f} (MFE)")
-                                st.metric("Худший P&L", f"{selected_trade.get('mae', 0):.2f} (MAE)")
-                            with col2:
-                                st.metric("Вход", f"{selected_trade.get('entry_price', 0):.2f} ₽")
-                                if use_live_data and not df_live.empty and current_price is not None:
-                                    st.metric("Текущая цена", f"{current_price:.2f} ₽")
-                                st.metric("Stop Loss", f"{selected_trade.get('stop_loss', 0):.2f} ₽")
-                            with col3:
-                                st.metric("Take Profit", f"{selected_trade.get('take_profit', 0):.2f} ₽")
-                                st.metric("AI Вероятность", f"{selected_trade.get('ai_probability', 0):.1%}")
+                            # Информация о позиции - одной таблицей (один элемент вместо семи st.metric)
+                            has_live = use_live_data and not df_live.empty
+                            metric_rows = [
+                                ("Текущий P&L", f"{current_pnl:.2f} ₽ (MFE: {selected_trade.get('mfe', 0):.2f})" if has_live
+                                 else f"{selected_trade.get('mfe', 0):.2f} (MFE)"),
+                                ("Худший P&L", f"{selected_trade.get('mae', 0):.2f} (MAE)"),
+                                ("Вход", f"{selected_trade.get('entry_price', 0):.2f} ₽"),
+                            ]
+                            if has_live and current_price is not None:
+                                metric_rows.append(("Текущая цена", f"{current_price:.2f} ₽"))
+                            metric_rows += [
+                                ("Stop Loss", f"{selected_trade.get('stop_loss', 0):.2f} ₽"),
+                                ("Take Profit", f"{selected_trade.get('take_profit', 0):.2f} ₽"),
+                                ("AI Вероятность", f"{selected_trade.get('ai_probability', 0):.1%}"),
+                            ]
+                            metrics_df = pd.DataFrame(metric_rows, columns=['Параметр', 'Значение'])
+                            st.dataframe(metrics_df, hide_index=True, use_container_width=True)
                             
                             st.plotly_chart(fig, use_container_width=True, width='stretch')
                             
@@ -1,17 +1,98 @@
 """
 Визуализация условий входа по параллельности для LONG и SHORT.
 """
-import pandas as pd
+import os
+import importlib.util
+import copy
+from functools import lru_cache
 import plotly.graph_objects as go
+import plotly.io as pio
 from plotly.subplots import make_subplots
 import numpy as np
+from types import SimpleNamespace
 
-def create_parallel_entry_visualization():
+# Настройки plotly.js для сохраняемого HTML: без логотипа, лишних кнопок выделения и зума колесом
+HTML_CONFIG = {
+    'responsive': True,
+    'displaylogo': False,
+    'modeBarButtonsToRemove': ['lasso2d', 'select2d', 'autoScale2d'],
+    'scrollZoom': False
+}
+
+def _pattern_derived(prices, idxs):
+    """
+    Производные величины линий 1-3 и 2-4 по точкам T1-T4 (prices/idxs - кортежи для T1, T2, T3, T4):
+    наклоны и середины линий (для подписей)
+    """
+    t1_price, t2_price, t3_price, t4_price = prices
+    t1_idx, t2_idx, t3_idx, t4_idx = idxs
+    return SimpleNamespace(
+        slope13=(t3_price - t1_price) / (t3_idx - t1_idx),
+        slope24=(t4_price - t2_price) / (t4_idx - t2_idx),
+        mid13_x=(t1_idx + t3_idx) / 2,
+        mid13_y=(t1_price + t3_price) / 2,
+        mid24_x=(t2_idx + t4_idx) / 2,
+        mid24_y=(t2_price + t4_price) / 2,
+    )
+
+def _on_subplot(traces, axis):
+    """Привязывает трейсы к осям одного subplot'а (axis - '' или '2') и возвращает их же"""
+    for trace in traces:
+        trace.update(xaxis=f'x{axis}', yaxis=f'y{axis}')
+    return traces
+
+def _annotations(axis, records):
+    """
+    Аннотации одного subplot'а (axis - '' или '2') из записей
+    (text, x, y, color, bgcolor, borderwidth, showarrow)
+    """
+    return [
+        dict(
+            x=x, y=y, xref=f'x{axis}', yref=f'y{axis}', text=text, showarrow=showarrow,
+            bgcolor=bgcolor, bordercolor=color, borderwidth=borderwidth,
+            **(dict(arrowhead=2, arrowcolor=color) if showarrow else {})
+        )
+        for text, x, y, color, bgcolor, borderwidth, showarrow in records
+    ]
+
+@lru_cache(maxsize=1)
+def _base_layout():
+    """
+    Неизменная часть layout (каркас subplot'ов с подписями, шаблон, заголовок, оси) - строится
+    один раз; вызывающий код берет глубокую копию и дописывает в нее только свои аннотации
+    """
+    layout = make_subplots(
+        rows=2, cols=1,
+        subplot_titles=('LONG: Условия входа по параллельности', 'SHORT: Условия входа по параллельности'),
+        vertical_spacing=0.15,
+        row_heights=[0.5, 0.5]
+    ).layout.to_plotly_json()
+    layout.update(
+        height=1200,
+        title=dict(text='Условия входа по параллельности: LONG и SHORT', x=0.5),
+        template=pio.templates['plotly_dark'].to_plotly_json(),
+        showlegend=True,
+        hovermode='x unified'
+    )
+    layout['xaxis']['title'] = dict(text='Индекс свечи')
+    layout['xaxis2']['title'] = dict(text='Индекс свечи')
+    layout['yaxis']['title'] = dict(text='Цена (LONG)')
+    layout['yaxis2']['title'] = dict(text='Цена (SHORT)')
+    return layout
+
+def create_parallel_entry_visualization(output_format='html'):
     """
     Создает визуализацию условий входа по параллельности.
+    Возвращает go.Figure.
+    output_format - 'html' (интерактивный график) или 'png' (статичная картинка;
+    нужен пакет kaleido>=1.0, в requirements.txt его нет - ставится отдельно)
     """
-    # Создаем пример данных для визуализации
-    np.random.seed(42)
+    if output_format not in ('html', 'png'):
+        raise ValueError(f"Неизвестный формат вывода: {output_format}")
+    if output_format == 'png' and importlib.util.find_spec('kaleido') is None:
+        raise ImportError("Для output_format='png' нужен пакет kaleido: pip install 'kaleido>=1.0'")
+    # Создаем пример данных для визуализации (свой генератор, глобальное состояние np.random не трогаем)
+    rng = np.random.default_rng(42)
     
     # Генерируем данные для LONG паттерна
     n_candles = 100
@@ -32,18 +113,20 @@ def create_parallel_entry_visualization():
     # Объединяем все части
     prices = np.concatenate([trend_up, correction_down, bounce_up, final_correction])
     
-    # Добавляем шум
-    noise = np.random.normal(0, 0.5, len(prices))
-    prices = prices + noise
+    n = len(prices)
+    
+    # Весь шум одним вызовом: строки - шум цены, high, low, close
+    z = rng.standard_normal((4, n))
+    prices = prices + 0.5 * z[0]
     
-    # Создаем DataFrame
-    df = pd.DataFrame({
+    # Свечи - словарь NumPy-массивов по колонкам (DataFrame здесь не нужен)
+    ohlc = {
         'open': prices,
-        'high': prices + np.abs(np.random.normal(0, 1, len(prices))),
-        'low': prices - np.abs(np.random.normal(0, 1, len(prices))),
-        'close': prices + np.random.normal(0, 0.5, len(prices)),
-        'volume': np.random.randint(1000, 10000, len(prices))
-    })
+        'high': prices + np.abs(z[1]),
+        'low': prices - np.abs(z[2]),
+        'close': prices + 0.5 * z[3],
+        'volume': rng.integers(1000, 10000, n)
+    }
     
     # Определяем точки паттерна
     t0_idx = 0
@@ -52,11 +135,9 @@ def create_parallel_entry_visualization():
     t3_idx = 64
     t4_idx = 79
     
-    t0_price = df.iloc[t0_idx]['close']
-    t1_price = df.iloc[t1_idx]['close']
-    t2_price = df.iloc[t2_idx]['close']
-    t3_price = df.iloc[t3_idx]['close']
-    t4_price = df.iloc[t4_idx]['close']
+    # Цены точек - одной выборкой из массива close
+    point_indices = [t0_idx, t1_idx, t2_idx, t3_idx, t4_idx]
+    t0_price, t1_price, t2_price, t3_price, t4_price = ohlc['close'][point_indices]
     
     # Создаем паттерн
     pattern_long = {
@@ -69,184 +150,116 @@ def create_parallel_entry_visualization():
     }
     
     # Вычисляем линии
-    slope_1_3 = (t3_price - t1_price) / (t3_idx - t1_idx)
-    slope_2_4 = (t4_price - t2_price) / (t4_idx - t2_idx)
-    
-    # Вычисляем цены линий для всех индексов
-    line_1_3_prices = []
-    line_2_4_prices = []
-    for i in range(len(df)):
-        # Линия 1-3
-        if t1_idx <= i <= t3_idx:
-            line_1_3_price = t1_price + slope_1_3 * (i - t1_idx)
-            line_1_3_prices.append(line_1_3_price)
-        else:
-            line_1_3_prices.append(None)
-        
-        # Линия 2-4
-        if t2_idx <= i <= t4_idx:
-            line_2_4_price = t2_price + slope_2_4 * (i - t2_idx)
-            line_2_4_prices.append(line_2_4_price)
-        else:
-            line_2_4_prices.append(None)
+    derived_long = _pattern_derived((t1_price, t2_price, t3_price, t4_price), (t1_idx, t2_idx, t3_idx, t4_idx))
+    slope_1_3 = derived_long.slope13
+    slope_2_4 = derived_long.slope24
+    
+    # Вычисляем цены линий для всех индексов (вне отрезка линии - NaN)
+    candle_idx = np.arange(n, dtype=np.int32)
+    m13 = (candle_idx >= t1_idx) & (candle_idx <= t3_idx)
+    m24 = (candle_idx >= t2_idx) & (candle_idx <= t4_idx)
+    line_1_3_prices = np.where(m13, t1_price + slope_1_3 * (candle_idx - t1_idx), np.nan)
+    line_2_4_prices = np.where(m24, t2_price + slope_2_4 * (candle_idx - t2_idx), np.nan)
     
     # Текущая цена (выше open T4 для LONG)
-    t4_open = df.iloc[t4_idx]['open']
+    t4_open = ohlc['open'][t4_idx]
     current_price_long = t4_open + 2  # Текущая цена выше open T4
     
-    # Создаем subplot для LONG
-    fig = make_subplots(
-        rows=2, cols=1,
-        subplot_titles=('LONG: Условия входа по параллельности', 'SHORT: Условия входа по параллельности'),
-        vertical_spacing=0.15,
-        row_heights=[0.5, 0.5]
-    )
+    # Трейсы и layout собираем обычными словарями (без go.Scatter и add_trace на каждый трейс),
+    # неизменная часть layout - из кэша
+    layout = copy.deepcopy(_base_layout())
+    long_traces = []
+    short_traces = []
     
     # === LONG ПАТТЕРН ===
-    indices = list(range(len(df)))
+    # Линии и маркеры рисуются через WebGL (Scattergl); свечи остаются Candlestick - GL-варианта у него нет
+    indices = candle_idx  # один массив индексов свечей на все трейсы
     
     # Свечи
-    fig.add_trace(
-        go.Candlestick(
-            x=indices,
-            open=df['open'],
-            high=df['high'],
-            low=df['low'],
-            close=df['close'],
-            name='Свечи (LONG)',
-            increasing_line_color='green',
-            decreasing_line_color='red'
-        ),
-        row=1, col=1
-    )
+    long_traces.append(dict(
+        type='candlestick',
+        x=indices,
+        open=ohlc['open'],
+        high=ohlc['high'],
+        low=ohlc['low'],
+        close=ohlc['close'],
+        name='Свечи (LONG)',
+        increasing=dict(line=dict(color='green')),
+        decreasing=dict(line=dict(color='red'))
+    ))
     
     # Точки паттерна
     point_names = ['T0', 'T1', 'T2', 'T3', 'T4']
-    point_indices = [t0_idx, t1_idx, t2_idx, t3_idx, t4_idx]
     point_prices = [t0_price, t1_price, t2_price, t3_price, t4_price]
     
-    for name, idx, price in zip(point_names, point_indices, point_prices):
-        fig.add_trace(
-            go.Scatter(
-                x=[idx],
-                y=[price],
-                mode='markers+text',
-                marker=dict(size=15, color='yellow', symbol='star'),
-                text=[name],
-                textposition='top center',
-                name=f'{name} (LONG)',
-                showlegend=False
-            ),
-            row=1, col=1
-        )
+    # Все точки - одним трейсом (у каждого трейса свои накладные расходы при отрисовке)
+    long_traces.append(dict(
+        type='scattergl',
+        x=point_indices,
+        y=point_prices,
+        mode='markers+text',
+        marker=dict(size=15, color='yellow', symbol='star'),
+        text=point_names,
+        textposition='top center',
+        name='T0-T4 (LONG)',
+        showlegend=False
+    ))
     
     # Линия 1-3
-    line_1_3_x = [i for i in range(t1_idx, t3_idx + 1)]
-    line_1_3_y = [t1_price + slope_1_3 * (i - t1_idx) for i in line_1_3_x]
-    fig.add_trace(
-        go.Scatter(
-            x=line_1_3_x,
-            y=line_1_3_y,
-            mode='lines',
-            name='Линия 1-3',
-            line=dict(color='blue', width=2, dash='dash')
-        ),
-        row=1, col=1
-    )
+    line_1_3_x = candle_idx[m13]
+    line_1_3_y = line_1_3_prices[m13]
+    long_traces.append(dict(
+        type='scattergl',
+        x=line_1_3_x,
+        y=line_1_3_y,
+        mode='lines',
+        name='Линия 1-3',
+        line=dict(color='blue', width=2, dash='dash')
+    ))
     
     # Линия 2-4
-    line_2_4_x = [i for i in range(t2_idx, t4_idx + 1)]
-    line_2_4_y = [t2_price + slope_2_4 * (i - t2_idx) for i in line_2_4_x]
-    fig.add_trace(
-        go.Scatter(
-            x=line_2_4_x,
-            y=line_2_4_y,
-            mode='lines',
-            name='Линия 2-4',
-            line=dict(color='orange', width=2, dash='dash')
-        ),
-        row=1, col=1
-    )
+    line_2_4_x = candle_idx[m24]
+    line_2_4_y = line_2_4_prices[m24]
+    long_traces.append(dict(
+        type='scattergl',
+        x=line_2_4_x,
+        y=line_2_4_y,
+        mode='lines',
+        name='Линия 2-4',
+        line=dict(color='orange', width=2, dash='dash')
+    ))
     
     # Open T4
-    fig.add_trace(
-        go.Scatter(
-            x=[t4_idx],
-            y=[t4_open],
-            mode='markers',
-            marker=dict(size=12, color='purple', symbol='circle'),
-            name='Open T4 (LONG)',
-            showlegend=True
-        ),
-        row=1, col=1
-    )
+    long_traces.append(dict(
+        type='scattergl',
+        x=[t4_idx],
+        y=[t4_open],
+        mode='markers',
+        marker=dict(size=12, color='purple', symbol='circle'),
+        name='Open T4 (LONG)',
+        showlegend=True
+    ))
     
     # Текущая цена (для LONG)
-    fig.add_trace(
-        go.Scatter(
-            x=[t4_idx],
-            y=[current_price_long],
-            mode='markers+text',
-            marker=dict(size=15, color='green', symbol='triangle-up'),
-            text=['Текущая цена<br>(ВХОД LONG)'],
-            textposition='top center',
-            name='Текущая цена (LONG)',
-            showlegend=True
-        ),
-        row=1, col=1
-    )
+    long_traces.append(dict(
+        type='scattergl',
+        x=[t4_idx],
+        y=[current_price_long],
+        mode='markers+text',
+        marker=dict(size=15, color='green', symbol='triangle-up'),
+        text=['Текущая цена<br>(ВХОД LONG)'],
+        textposition='top center',
+        name='Текущая цена (LONG)',
+        showlegend=True
+    ))
     
     # Аннотации для LONG
-    annotations_long = [
-        dict(
-            x=t4_idx,
-            y=current_price_long + 3,
-            xref='x',
-            yref='y',
-            text='✅ LONG: current_price > open T4',
-            showarrow=True,
-            arrowhead=2,
-            arrowcolor='green',
-            bgcolor='rgba(0, 255, 0, 0.3)',
-            bordercolor='green',
-            borderwidth=2
-        ),
-        dict(
-            x=(t1_idx + t3_idx) / 2,
-            y=(t1_price + t3_price) / 2 + 2,
-            xref='x',
-            yref='y',
-            text=f'Линия 1-3<br>slope={slope_1_3:.3f}',
-            showarrow=False,
-            bgcolor='rgba(0, 0, 255, 0.2)',
-            bordercolor='blue',
-            borderwidth=1
-        ),
-        dict(
-            x=(t2_idx + t4_idx) / 2,
-            y=(t2_price + t4_price) / 2 - 2,
-            xref='x',
-            yref='y',
-            text=f'Линия 2-4<br>slope={slope_2_4:.3f}',
-            showarrow=False,
-            bgcolor='rgba(255, 165, 0, 0.2)',
-            bordercolor='orange',
-            borderwidth=1
-        ),
-        dict(
-            x=t2_idx,
-            y=t2_price + 1,
-            xref='x',
-            yref='y',
-            text='T4 < T2 ✅',
-            showarrow=True,
-            arrowhead=2,
-            arrowcolor='green',
-            bgcolor='rgba(0, 255, 0, 0.2)',
-            bordercolor='green',
-            borderwidth=1
-        )
-    ]
+    annotations_long = _annotations('', [
+        ('✅ LONG: current_price > open T4', t4_idx, current_price_long + 3, 'green', 'rgba(0, 255, 0, 0.3)', 2, True),
+        (f'Линия 1-3<br>slope={slope_1_3:.3f}', derived_long.mid13_x, derived_long.mid13_y + 2, 'blue', 'rgba(0, 0, 255, 0.2)', 1, False),
+        (f'Линия 2-4<br>slope={slope_2_4:.3f}', derived_long.mid24_x, derived_long.mid24_y - 2, 'orange', 'rgba(255, 165, 0, 0.2)', 1, False),
+        ('T4 < T2 ✅', t2_idx, t2_price + 1, 'green', 'rgba(0, 255, 0, 0.2)', 1, True),
+    ])
     
     # === SHORT ПАТТЕРН ===
     # Создаем данные для SHORT (зеркально)
@@ -265,189 +278,136 @@ def create_parallel_entry_visualization():
     final_correction_up = np.linspace(base_price_short - 18, base_price_short - 12, 15)
     
     prices_short = np.concatenate([trend_down, correction_up, bounce_down, final_correction_up])
-    noise_short = np.random.normal(0, 0.5, len(prices_short))
-    prices_short = prices_short + noise_short
+    z_short = rng.standard_normal((4, len(prices_short)))
+    prices_short = prices_short + 0.5 * z_short[0]
     
-    df_short = pd.DataFrame({
+    ohlc_short = {
         'open': prices_short,
-        'high': prices_short + np.abs(np.random.normal(0, 1, len(prices_short))),
-        'low': prices_short - np.abs(np.random.normal(0, 1, len(prices_short))),
-        'close': prices_short + np.random.normal(0, 0.5, len(prices_short)),
-        'volume': np.random.randint(1000, 10000, len(prices_short))
-    })
-    
-    t0_price_short = df_short.iloc[t0_idx]['close']
-    t1_price_short = df_short.iloc[t1_idx]['close']
-    t2_price_short = df_short.iloc[t2_idx]['close']
-    t3_price_short = df_short.iloc[t3_idx]['close']
-    t4_price_short = df_short.iloc[t4_idx]['close']
+        'high': prices_short + np.abs(z_short[1]),
+        'low': prices_short - np.abs(z_short[2]),
+        'close': prices_short + 0.5 * z_short[3],
+        'volume': rng.integers(1000, 10000, len(prices_short))
+    }
+    
+    t0_price_short, t1_price_short, t2_price_short, t3_price_short, t4_price_short = ohlc_short['close'][point_indices]
     
     # Вычисляем линии для SHORT
-    slope_1_3_short = (t3_price_short - t1_price_short) / (t3_idx - t1_idx)
-    slope_2_4_short = (t4_price_short - t2_price_short) / (t4_idx - t2_idx)
+    derived_short = _pattern_derived(
+        (t1_price_short, t2_price_short, t3_price_short, t4_price_short), (t1_idx, t2_idx, t3_idx, t4_idx)
+    )
+    slope_1_3_short = derived_short.slope13
+    slope_2_4_short = derived_short.slope24
     
     # Свечи SHORT
-    fig.add_trace(
-        go.Candlestick(
-            x=indices,
-            open=df_short['open'],
-            high=df_short['high'],
-            low=df_short['low'],
-            close=df_short['close'],
-            name='Свечи (SHORT)',
-            increasing_line_color='green',
-            decreasing_line_color='red'
-        ),
-        row=2, col=1
-    )
+    short_traces.append(dict(
+        type='candlestick',
+        x=indices,
+        open=ohlc_short['open'],
+        high=ohlc_short['high'],
+        low=ohlc_short['low'],
+        close=ohlc_short['close'],
+        name='Свечи (SHORT)',
+        increasing=dict(line=dict(color='green')),
+        decreasing=dict(line=dict(color='red'))
+    ))
     
     # Точки паттерна SHORT
     point_prices_short = [t0_price_short, t1_price_short, t2_price_short, t3_price_short, t4_price_short]
-    for name, idx, price in zip(point_names, point_indices, point_prices_short):
-        fig.add_trace(
-            go.Scatter(
-                x=[idx],
-                y=[price],
-                mode='markers+text',
-                marker=dict(size=15, color='yellow', symbol='star'),
-                text=[name],
-                textposition='top center',
-                name=f'{name} (SHORT)',
-                showlegend=False
-            ),
-            row=2, col=1
-        )
+    short_traces.append(dict(
+        type='scattergl',
+        x=point_indices,
+        y=point_prices_short,
+        mode='markers+text',
+        marker=dict(size=15, color='yellow', symbol='star'),
+        text=point_names,
+        textposition='top center',
+        name='T0-T4 (SHORT)',
+        showlegend=False
+    ))
     
     # Линия 1-3 SHORT
-    line_1_3_y_short = [t1_price_short + slope_1_3_short * (i - t1_idx) for i in line_1_3_x]
-    fig.add_trace(
-        go.Scatter(
-            x=line_1_3_x,
-            y=line_1_3_y_short,
-            mode='lines',
-            name='Линия 1-3 (SHORT)',
-            line=dict(color='blue', width=2, dash='dash'),
-            showlegend=False
-        ),
-        row=2, col=1
-    )
+    line_1_3_y_short = t1_price_short + slope_1_3_short * (line_1_3_x - t1_idx)
+    short_traces.append(dict(
+        type='scattergl',
+        x=line_1_3_x,
+        y=line_1_3_y_short,
+        mode='lines',
+        name='Линия 1-3 (SHORT)',
+        line=dict(color='blue', width=2, dash='dash'),
+        showlegend=False
+    ))
     
     # Линия 2-4 SHORT
-    line_2_4_y_short = [t2_price_short + slope_2_4_short * (i - t2_idx) for i in line_2_4_x]
-    fig.add_trace(
-        go.Scatter(
-            x=line_2_4_x,
-            y=line_2_4_y_short,
-            mode='lines',
-            name='Линия 2-4 (SHORT)',
-            line=dict(color='orange', width=2, dash='dash'),
-            showlegend=False
-        ),
-        row=2, col=1
-    )
+    line_2_4_y_short = t2_price_short + slope_2_4_short * (line_2_4_x - t2_idx)
+    short_traces.append(dict(
+        type='scattergl',
+        x=line_2_4_x,
+        y=line_2_4_y_short,
+        mode='lines',
+        name='Линия 2-4 (SHORT)',
+        line=dict(color='orange', width=2, dash='dash'),
+        showlegend=False
+    ))
     
     # Open T4 SHORT
-    t4_open_short = df_short.iloc[t4_idx]['open']
-    fig.add_trace(
-        go.Scatter(
-            x=[t4_idx],
-            y=[t4_open_short],
-            mode='markers',
-            marker=dict(size=12, color='purple', symbol='circle'),
-            name='Open T4 (SHORT)',
-            showlegend=False
-        ),
-        row=2, col=1
-    )
+    t4_open_short = ohlc_short['open'][t4_idx]
+    short_traces.append(dict(
+        type='scattergl',
+        x=[t4_idx],
+        y=[t4_open_short],
+        mode='markers',
+        marker=dict(size=12, color='purple', symbol='circle'),
+        name='Open T4 (SHORT)',
+        showlegend=False
+    ))
     
     # Текущая цена (для SHORT - ниже open T4)
     current_price_short = t4_open_short - 2
-    fig.add_trace(
-        go.Scatter(
-            x=[t4_idx],
-            y=[current_price_short],
-            mode='markers+text',
-            marker=dict(size=15, color='red', symbol='triangle-down'),
-            text=['Текущая цена<br>(ВХОД SHORT)'],
-            textposition='bottom center',
-            name='Текущая цена (SHORT)',
-            showlegend=False
-        ),
-        row=2, col=1
-    )
+    short_traces.append(dict(
+        type='scattergl',
+        x=[t4_idx],
+        y=[current_price_short],
+        mode='markers+text',
+        marker=dict(size=15, color='red', symbol='triangle-down'),
+        text=['Текущая цена<br>(ВХОД SHORT)'],
+        textposition='bottom center',
+        name='Текущая цена (SHORT)',
+        showlegend=False
+    ))
     
     # Аннотации для SHORT
-    annotations_short = [
-        dict(
-            x=t4_idx,
-            y=current_price_short - 3,
-            xref='x2',
-            yref='y2',
-            text='✅ SHORT: current_price < open T4',
-            showarrow=True,
-            arrowhead=2,
-            arrowcolor='red',
-            bgcolor='rgba(255, 0, 0, 0.3)',
-            bordercolor='red',
-            borderwidth=2
-        ),
-        dict(
-            x=(t1_idx + t3_idx) / 2,
-            y=(t1_price_short + t3_price_short) / 2 - 2,
-            xref='x2',
-            yref='y2',
-            text=f'Линия 1-3<br>slope={slope_1_3_short:.3f}',
-            showarrow=False,
-            bgcolor='rgba(0, 0, 255, 0.2)',
-            bordercolor='blue',
-            borderwidth=1
-        ),
-        dict(
-            x=(t2_idx + t4_idx) / 2,
-            y=(t2_price_short + t4_price_short) / 2 + 2,
-            xref='x2',
-            yref='y2',
-            text=f'Линия 2-4<br>slope={slope_2_4_short:.3f}',
-            showarrow=False,
-            bgcolor='rgba(255, 165, 0, 0.2)',
-            bordercolor='orange',
-            borderwidth=1
-        ),
-        dict(
-            x=t2_idx,
-            y=t2_price_short - 1,
-            xref='x2',
-            yref='y2',
-            text='T4 > T2 ✅',
-            showarrow=True,
-            arrowhead=2,
-            arrowcolor='red',
-            bgcolor='rgba(255, 0, 0, 0.2)',
-            bordercolor='red',
-            borderwidth=1
-        )
-    ]
-    
-    # Обновляем layout
-    fig.update_layout(
-        height=1200,
-        title_text='Условия входа по параллельности: LONG и SHORT',
-        title_x=0.5,
-        template='plotly_dark',
-        showlegend=True,
-        hovermode='x unified',
-        annotations=annotations_long + annotations_short
-    )
-    
-    # Обновляем оси
-    fig.update_xaxes(title_text='Индекс свечи', row=1, col=1)
-    fig.update_xaxes(title_text='Индекс свечи', row=2, col=1)
-    fig.update_yaxes(title_text='Цена (LONG)', row=1, col=1)
-    fig.update_yaxes(title_text='Цена (SHORT)', row=2, col=1)
+    annotations_short = _annotations('2', [
+        ('✅ SHORT: current_price < open T4', t4_idx, current_price_short - 3, 'red', 'rgba(255, 0, 0, 0.3)', 2, True),
+        (f'Линия 1-3<br>slope={slope_1_3_short:.3f}', derived_short.mid13_x, derived_short.mid13_y - 2, 'blue', 'rgba(0, 0, 255, 0.2)', 1, False),
+        (f'Линия 2-4<br>slope={slope_2_4_short:.3f}', derived_short.mid24_x, derived_short.mid24_y + 2, 'orange', 'rgba(255, 165, 0, 0.2)', 1, False),
+        ('T4 > T2 ✅', t2_idx, t2_price_short - 1, 'red', 'rgba(255, 0, 0, 0.2)', 1, True),
+    ])
+    
+    # Подписи subplot'ов уже в layout - дописываем свои аннотации
+    layout['annotations'] += annotations_long + annotations_short
+    
+    # Оси задаются сразу всей группе трейсов subplot'а, а не каждому трейсу по отдельности
+    data = _on_subplot(long_traces, '') + _on_subplot(short_traces, '2')
+    # Фигура собрана обычными словарями и оборачивается в go.Figure один раз, перед записью
+    # (массивы NumPy plotly сам кодирует в base64 при сериализации)
+    fig_dict = dict(data=data, layout=layout)
+    fig = go.Figure(fig_dict, skip_invalid=True)
     
     # Сохраняем
     output_file = 'parallel_entry_conditions_visualization.html'
-    fig.write_html(output_file)
+    if output_format == 'html':
+        # plotly.js подключается с CDN, а не встраивается (~3 МБ) в каждый файл. Пишем во временный
+        # файл и подменяем им итоговый, чтобы при повторной генерации не остался недописанный HTML
+        tmp_file = output_file + '.tmp'
+        fig.write_html(
+            tmp_file, include_plotlyjs='cdn', include_mathjax=False, full_html=True,
+            validate=False, auto_open=False, config=HTML_CONFIG
+        )
+        os.replace(tmp_file, output_file)
+    else:
+        # Статичная картинка через kaleido: без plotly.js и браузера, файл в десятки КБ
+        output_file = output_file.replace('.html', '.png')
+        fig.write_image(output_file, width=1400, height=layout['height'], scale=1, validate=False)
     print(f"✅ Визуализация сохранена: {output_file}")
     print()
     print("=" * 70)
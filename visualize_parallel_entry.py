@@ -2,16 +2,72 @@
 Визуализация логики входа в позицию на основе параллельности линий 1-3 и 2-4
 """
 
-import pandas as pd
+import os
+import importlib.util
+import copy
+from functools import lru_cache
 import numpy as np
 import plotly.graph_objects as go
+import plotly.io as pio
 from plotly.subplots import make_subplots
 from datetime import datetime, timedelta
+from trading_bot.parallel_entry_strategy import parallel_check
 
-def create_parallel_entry_visualization():
+# Для одной проверки JIT-компиляция numba дороже самой проверки - берем исходную Python-функцию
+parallel_check = getattr(parallel_check, 'py_func', parallel_check)
+
+# Настройки plotly.js для сохраняемого HTML: без логотипа, лишних кнопок выделения и зума колесом
+HTML_CONFIG = {
+    'responsive': True,
+    'displaylogo': False,
+    'modeBarButtonsToRemove': ['lasso2d', 'select2d', 'autoScale2d'],
+    'scrollZoom': False
+}
+
+@lru_cache(maxsize=1)
+def _base_layout():
+    """
+    Неизменная часть layout (каркас subplot'ов с подписями, шаблон, оси) - строится один раз;
+    вызывающий код берет глубокую копию и дописывает заголовок и аннотацию с условиями
+    """
+    layout = make_subplots(
+        rows=2, cols=1,
+        shared_xaxes=True,
+        vertical_spacing=0.03,
+        row_heights=[0.7, 0.3],
+        subplot_titles=('Логика входа по параллельности линий 1-3 и 2-4', 'Объем')
+    ).layout.to_plotly_json()
+    layout.update(
+        height=900,
+        showlegend=True,
+        hovermode='x unified',
+        template=pio.templates["plotly_dark"].to_plotly_json()
+    )
+    # Оси дополняем: в каркасе у них уже домены и связь shared_xaxes
+    grid = dict(showgrid=True, gridcolor='rgba(128, 128, 128, 0.2)')
+    layout['xaxis'].update(title=dict(text='Индекс свечи'), rangeslider=dict(visible=False), **grid)
+    layout['xaxis2'].update(title=dict(text='Индекс свечи'), **grid)
+    layout['yaxis'].update(title=dict(text="Цена"), **grid)
+    layout['yaxis2'].update(title=dict(text="Объем"), **grid)
+    return layout
+
+def _on_subplot(traces, axis):
+    """Привязывает трейсы к осям одного subplot'а (axis - '' или '2') и возвращает их же"""
+    for trace in traces:
+        trace.update(xaxis=f'x{axis}', yaxis=f'y{axis}')
+    return traces
+
+def create_parallel_entry_visualization(output_format='html'):
     """
     Создает визуализацию логики входа по параллельности линий
+    Возвращает go.Figure.
+    output_format - 'html' (интерактивный график) или 'png' (статичная картинка;
+    нужен пакет kaleido>=1.0, в requirements.txt его нет - ставится отдельно)
     """
+    if output_format not in ('html', 'png'):
+        raise ValueError(f"Неизвестный формат вывода: {output_format}")
+    if output_format == 'png' and importlib.util.find_spec('kaleido') is None:
+        raise ImportError("Для output_format='png' нужен пакет kaleido: pip install 'kaleido>=1.0'")
     
     # Создаем пример данных для бычьего паттерна
     # T0: 280, T1: 310, T2: 295, T3: 305, T4: 290
@@ -30,89 +86,66 @@ def create_parallel_entry_visualization():
     t3_price = 305
     t4_price = 290
     
-    # Создаем DataFrame со свечами
-    indices = list(range(80))
-    dates = [datetime.now() + timedelta(hours=i) for i in indices]
+    # Индексы и время свечей
+    indices = np.arange(80, dtype=np.int32)  # один массив индексов свечей на все трейсы
+    dates = [datetime.now() + timedelta(hours=int(i)) for i in indices]
+    
+    # Генерируем цены свечей, которые формируют паттерн (сразу массивами по всем свечам).
+    # Свечи - словарь NumPy-массивов по колонкам (DataFrame здесь не нужен)
+    n = len(indices)
+    rng = np.random.default_rng(42)
+    idx = indices
     
-    # Генерируем цены свечей, которые формируют паттерн
-    candles = []
-    for i in indices:
-        if i <= t0_idx:
-            price = t0_price + np.random.uniform(-2, 2)
-        elif i <= t1_idx:
-            # Восходящий тренд T0-T1
-            progress = (i - t0_idx) / (t1_idx - t0_idx)
-            base_price = t0_price + (t1_price - t0_price) * progress
-            price = base_price + np.random.uniform(-3, 3)
-        elif i <= t2_idx:
-            # Коррекция T1-T2
-            progress = (i - t1_idx) / (t2_idx - t1_idx)
-            base_price = t1_price + (t2_price - t1_price) * progress
-            price = base_price + np.random.uniform(-2, 2)
-        elif i <= t3_idx:
-            # Отскок T2-T3
-            progress = (i - t2_idx) / (t3_idx - t2_idx)
-            base_price = t2_price + (t3_price - t2_price) * progress
-            price = base_price + np.random.uniform(-2, 2)
-        elif i <= t4_idx:
-            # Коррекция T3-T4
-            progress = (i - t3_idx) / (t4_idx - t3_idx)
-            base_price = t3_price + (t4_price - t3_price) * progress
-            price = base_price + np.random.uniform(-2, 2)
-        else:
-            # После T4 - отскок вверх (зеленая свеча на входе)
-            if i == t4_idx + 1:
-                price = t4_price + 5  # Зеленая свеча - отскок
-            else:
-                price = t4_price + 5 + (i - t4_idx - 1) * 0.5 + np.random.uniform(-1, 1)
-        
-        # Создаем свечу
-        open_price = price
-        close_price = price + np.random.uniform(-2, 2)
-        high_price = max(open_price, close_price) + abs(np.random.uniform(0, 2))
-        low_price = min(open_price, close_price) - abs(np.random.uniform(0, 2))
-        
-        # На T4 делаем зеленую свечу (вход)
-        if i == t4_idx:
-            close_price = open_price + 3  # Зеленая свеча
-        
-        candles.append({
-            'time': dates[i],
-            'open': open_price,
-            'high': high_price,
-            'low': low_price,
-            'close': close_price,
-            'volume': np.random.uniform(1000, 5000)
-        })
+    # Базовая цена: кусочно-линейно T0 -> T1 (тренд) -> T2 (коррекция) -> T3 (отскок) -> T4 (коррекция),
+    # после T4 - отскок вверх от T4 + 5 с шагом 0.5 (один np.interp по опорным точкам)
+    base = np.interp(
+        idx,
+        [t0_idx, t1_idx, t2_idx, t3_idx, t4_idx, t4_idx + 1, n - 1],
+        [t0_price, t1_price, t2_price, t3_price, t4_price, t4_price + 5, t4_price + 5 + (n - t4_idx - 2) * 0.5]
+    )
+    # Шум: ±3 на тренде T0-T1, ±2 до T4, ±1 после; свеча сразу после T4 - без шума (отскок)
+    noise_amp = np.select([idx <= t0_idx, idx <= t1_idx, idx <= t4_idx], [2.0, 3.0, 2.0], default=1.0)
+    noise_amp[t4_idx + 1:t4_idx + 2] = 0.0
     
-    df = pd.DataFrame(candles)
+    # Все случайные величины одним вызовом: строки - шум цены, тело свечи, тени вверх/вниз, объем
+    u = rng.random((5, n))
+    open_arr = base + (2 * u[0] - 1) * noise_amp
+    close_arr = open_arr + (4 * u[1] - 2)
+    high_arr = np.maximum(open_arr, close_arr) + 2 * u[2]
+    low_arr = np.minimum(open_arr, close_arr) - 2 * u[3]
+    # На T4 делаем зеленую свечу (вход)
+    close_arr[t4_idx] = open_arr[t4_idx] + 3
+    
+    ohlc = {
+        'time': np.array(dates),
+        'open': open_arr,
+        'high': high_arr,
+        'low': low_arr,
+        'close': close_arr,
+        'volume': 1000 + 4000 * u[4]
+    }
     
     # Создаем график
-    fig = make_subplots(
-        rows=2, cols=1,
-        shared_xaxes=True,
-        vertical_spacing=0.03,
-        row_heights=[0.7, 0.3],
-        subplot_titles=('Логика входа по параллельности линий 1-3 и 2-4', 'Объем')
-    )
+    # Линии и маркеры рисуются через WebGL (Scattergl); свечи остаются Candlestick - GL-варианта у него нет
+    # Трейсы и layout собираем обычными словарями (без go.Scatter и add_trace на каждый трейс),
+    # неизменная часть layout - из кэша
+    layout = copy.deepcopy(_base_layout())
+    price_traces = []
     
-    # Свечи
-    colors = ['red' if df.iloc[i]['close'] < df.iloc[i]['open'] else 'green' 
-              for i in range(len(df))]
+    # Свечи (цвета столбцов объема - одним сравнением по массивам)
+    colors = np.where(close_arr < open_arr, 'red', 'green')
     
-    fig.add_trace(
-        go.Candlestick(
-            x=indices,
-            open=df['open'],
-            high=df['high'],
-            low=df['low'],
-            close=df['close'],
-            name='Свечи',
-            increasing_line_color='green',
-            decreasing_line_color='red'
-        ),
-        row=1, col=1
-    )
+    price_traces.append(dict(
+        type='candlestick',
+        x=indices,
+        open=ohlc['open'],
+        high=ohlc['high'],
+        low=ohlc['low'],
+        close=ohlc['close'],
+        name='Свечи',
+        increasing=dict(line=dict(color='green')),
+        decreasing=dict(line=dict(color='red'))
+    ))
     
     # Точки паттерна
     point_colors = {'T0': 'lime', 'T1': 'red', 'T2': 'cyan', 'T3': 'orange', 'T4': 'magenta'}
@@ -126,176 +159,126 @@ def create_parallel_entry_visualization():
         'T4': {'idx': t4_idx, 'price': t4_price}
     }
     
-    for point_name, point_data in points.items():
-        fig.add_trace(
-            go.Scatter(
-                x=[point_data['idx']],
-                y=[point_data['price']],
-                mode='markers',
-                marker=dict(
-                    symbol=point_symbols[point_name],
-                    size=15,
-                    color=point_colors[point_name],
-                    line=dict(width=2, color='white')
-                ),
-                name=point_name,
-                text=[point_name],
-                textposition="top center",
-                hovertemplate=f'<b>{point_name}</b><br>Индекс: {point_data["idx"]}<br>Цена: {point_data["price"]:.2f}<extra></extra>'
-            ),
-            row=1, col=1
-        )
+    # Все точки - одним трейсом: цвет и символ задаются массивами по точкам
+    point_names = list(points)
+    price_traces.append(dict(
+        type='scattergl',
+        x=[points[name]['idx'] for name in point_names],
+        y=[points[name]['price'] for name in point_names],
+        mode='markers',
+        marker=dict(
+            symbol=[point_symbols[name] for name in point_names],
+            size=15,
+            color=[point_colors[name] for name in point_names],
+            line=dict(width=2, color='white')
+        ),
+        name='Точки T0-T4',
+        text=point_names,
+        textposition="top center",
+        hovertemplate='<b>%{text}</b><br>Индекс: %{x}<br>Цена: %{y:.2f}<extra></extra>'
+    ))
     
     # Линия 1-3 (T1-T3)
     line_1_3_x = [t1_idx, t3_idx]
     line_1_3_y = [t1_price, t3_price]
-    fig.add_trace(
-        go.Scatter(
-            x=line_1_3_x,
-            y=line_1_3_y,
-            mode='lines',
-            line=dict(color='yellow', width=2, dash='dash'),
-            name='Линия 1-3 (T1-T3)',
-            hovertemplate='Линия 1-3<extra></extra>'
-        ),
-        row=1, col=1
-    )
+    price_traces.append(dict(
+        type='scattergl',
+        x=line_1_3_x,
+        y=line_1_3_y,
+        mode='lines',
+        line=dict(color='yellow', width=2, dash='dash'),
+        name='Линия 1-3 (T1-T3)',
+        hovertemplate='Линия 1-3<extra></extra>'
+    ))
     
     # Линия 2-4 (T2-T4)
     line_2_4_x = [t2_idx, t4_idx]
     line_2_4_y = [t2_price, t4_price]
-    fig.add_trace(
-        go.Scatter(
-            x=line_2_4_x,
-            y=line_2_4_y,
-            mode='lines',
-            line=dict(color='purple', width=2, dash='dash'),
-            name='Линия 2-4 (T2-T4)',
-            hovertemplate='Линия 2-4<extra></extra>'
-        ),
-        row=1, col=1
-    )
+    price_traces.append(dict(
+        type='scattergl',
+        x=line_2_4_x,
+        y=line_2_4_y,
+        mode='lines',
+        line=dict(color='purple', width=2, dash='dash'),
+        name='Линия 2-4 (T2-T4)',
+        hovertemplate='Линия 2-4<extra></extra>'
+    ))
     
-    # Вычисляем slope для проверки параллельности
-    slope_1_3 = (t3_price - t1_price) / (t3_idx - t1_idx) if (t3_idx - t1_idx) != 0 else 0
-    slope_2_4 = (t4_price - t2_price) / (t4_idx - t2_idx) if (t4_idx - t2_idx) != 0 else 0
+    # Вычисляем slope и информацию о параллельности
+    slope_1_3, slope_2_4, relative_diff, is_parallel = parallel_check(
+        t1_idx, t1_price, t3_idx, t3_price, t2_idx, t2_price, t4_idx, t4_price, 0.1
+    )
     
-    # Продлеваем линии для визуализации параллельности
+    # Продлеваем линии для визуализации параллельности: только внешние отрезки (до начала и после
+    # конца линии) в одном массиве через NaN - plotly рвет на нем линию, поэтому оба отрезка рисуются
+    # одним трейсом, а пунктир не ложится поверх самой линии
     extend_range = 10
-    line_1_3_extended_x = [t1_idx - extend_range, t3_idx + extend_range]
-    line_1_3_extended_y = [
-        t1_price - slope_1_3 * extend_range,
-        t3_price + slope_1_3 * extend_range
-    ]
-    fig.add_trace(
-        go.Scatter(
-            x=line_1_3_extended_x,
-            y=line_1_3_extended_y,
-            mode='lines',
-            line=dict(color='yellow', width=1, dash='dot'),
-            name='Линия 1-3 (продолжение)',
-            showlegend=False,
-            hoverinfo='skip'
-        ),
-        row=1, col=1
-    )
+    line_1_3_extended_x = np.array([t1_idx - extend_range, t1_idx, np.nan, t3_idx, t3_idx + extend_range])
+    line_1_3_extended_y = np.array([
+        t1_price - slope_1_3 * extend_range, t1_price,
+        np.nan,
+        t3_price, t3_price + slope_1_3 * extend_range
+    ])
+    price_traces.append(dict(
+        type='scattergl',
+        x=line_1_3_extended_x,
+        y=line_1_3_extended_y,
+        mode='lines',
+        line=dict(color='yellow', width=1, dash='dot'),
+        name='Линия 1-3 (продолжение)',
+        showlegend=False,
+        hoverinfo='skip'
+    ))
     
-    line_2_4_extended_x = [t2_idx - extend_range, t4_idx + extend_range]
-    line_2_4_extended_y = [
-        t2_price - slope_2_4 * extend_range,
-        t4_price + slope_2_4 * extend_range
-    ]
-    fig.add_trace(
-        go.Scatter(
-            x=line_2_4_extended_x,
-            y=line_2_4_extended_y,
-            mode='lines',
-            line=dict(color='purple', width=1, dash='dot'),
-            name='Линия 2-4 (продолжение)',
-            showlegend=False,
-            hoverinfo='skip'
-        ),
-        row=1, col=1
-    )
+    line_2_4_extended_x = np.array([t2_idx - extend_range, t2_idx, np.nan, t4_idx, t4_idx + extend_range])
+    line_2_4_extended_y = np.array([
+        t2_price - slope_2_4 * extend_range, t2_price,
+        np.nan,
+        t4_price, t4_price + slope_2_4 * extend_range
+    ])
+    price_traces.append(dict(
+        type='scattergl',
+        x=line_2_4_extended_x,
+        y=line_2_4_extended_y,
+        mode='lines',
+        line=dict(color='purple', width=1, dash='dot'),
+        name='Линия 2-4 (продолжение)',
+        showlegend=False,
+        hoverinfo='skip'
+    ))
     
     # Маркер входа (на T4)
     entry_idx = t4_idx
     entry_price = t4_price
-    fig.add_trace(
-        go.Scatter(
-            x=[entry_idx],
-            y=[entry_price],
-            mode='markers',
-            marker=dict(
-                symbol='star',
-                size=20,
-                color='white',
-                line=dict(width=2, color='green')
-            ),
-            name='ВХОД (T4)',
-            text=['ВХОД'],
-            textposition="top center",
-            hovertemplate='<b>ВХОД В ПОЗИЦИЮ</b><br>Индекс: {}<br>Цена: {:.2f}<extra></extra>'.format(entry_idx, entry_price)
+    price_traces.append(dict(
+        type='scattergl',
+        x=[entry_idx],
+        y=[entry_price],
+        mode='markers',
+        marker=dict(
+            symbol='star',
+            size=20,
+            color='white',
+            line=dict(width=2, color='green')
         ),
-        row=1, col=1
-    )
+        name='ВХОД (T4)',
+        text=['ВХОД'],
+        textposition="top center",
+        hovertemplate=f'<b>ВХОД В ПОЗИЦИЮ</b><br>Индекс: {entry_idx}<br>Цена: {entry_price:.2f}<extra></extra>'
+    ))
     
     # Объем
-    fig.add_trace(
-        go.Bar(
-            x=indices,
-            y=df['volume'],
-            name='Объем',
-            marker_color=colors
-        ),
-        row=2, col=1
+    volume_trace = dict(
+        type='bar',
+        x=indices,
+        y=ohlc['volume'],
+        name='Объем',
+        marker=dict(color=colors)
     )
     
-    # Вычисляем информацию о параллельности
-    avg_slope = (abs(slope_1_3) + abs(slope_2_4)) / 2
-    diff = abs(slope_1_3 - slope_2_4)
-    relative_diff = diff / avg_slope if avg_slope != 0 else 0
-    is_parallel = relative_diff <= 0.1
-    
     # Условия для LONG
     t4_below_t2 = t4_price < t2_price
-    is_green_candle = df.iloc[t4_idx]['close'] > df.iloc[t4_idx]['open']
-    
-    # Обновляем layout
-    fig.update_layout(
-        height=900,
-        showlegend=True,
-        hovermode='x unified',
-        xaxis_rangeslider_visible=False,
-        template="plotly_dark",
-        title=dict(
-            text="<b>Логика входа по параллельности линий 1-3 и 2-4 (LONG)</b><br>" +
-                 f"<span style='font-size:12px'>Slope 1-3: {slope_1_3:.4f} | Slope 2-4: {slope_2_4:.4f} | " +
-                 f"Отклонение: {relative_diff*100:.2f}% | Параллельны: {'✅' if is_parallel else '❌'}</span>",
-            x=0.5,
-            xanchor='center'
-        ),
-        xaxis=dict(
-            title='Индекс свечи',
-            showgrid=True,
-            gridcolor='rgba(128, 128, 128, 0.2)'
-        ),
-        xaxis2=dict(
-            title='Индекс свечи',
-            showgrid=True,
-            gridcolor='rgba(128, 128, 128, 0.2)'
-        ),
-        yaxis=dict(
-            title_text="Цена",
-            showgrid=True,
-            gridcolor='rgba(128, 128, 128, 0.2)'
-        ),
-        yaxis2=dict(
-            title_text="Объем",
-            showgrid=True,
-            gridcolor='rgba(128, 128, 128, 0.2)'
-        )
-    )
+    is_green_candle = ohlc['close'][t4_idx] > ohlc['open'][t4_idx]
     
     # Добавляем аннотации с условиями
     conditions_text = (
@@ -306,7 +289,7 @@ def create_parallel_entry_visualization():
         f"<br><b>РЕЗУЛЬТАТ:</b> {'✅ ВХОД РАЗРЕШЕН' if (is_parallel and t4_below_t2 and is_green_candle) else '❌ ВХОД ЗАПРЕЩЕН'}"
     )
     
-    fig.add_annotation(
+    conditions_annotation = dict(
         text=conditions_text,
         xref="paper", yref="paper",
         x=0.02, y=0.98,
@@ -318,9 +301,40 @@ def create_parallel_entry_visualization():
         showarrow=False
     )
     
+    # Обновляем layout: заголовок и аннотация с условиями (подписи subplot'ов уже в layout)
+    layout['title'] = dict(
+        text=(
+            f"<b>Логика входа по параллельности линий 1-3 и 2-4 (LONG)</b><br>"
+            f"<span style='font-size:12px'>Slope 1-3: {slope_1_3:.4f} | Slope 2-4: {slope_2_4:.4f} | "
+            f"Отклонение: {relative_diff*100:.2f}% | Параллельны: {'✅' if is_parallel else '❌'}</span>"
+        ),
+        x=0.5,
+        xanchor='center'
+    )
+    layout['annotations'].append(conditions_annotation)
+    
+    # Оси задаются сразу всей группе трейсов subplot'а, а не каждому трейсу по отдельности
+    data = _on_subplot(price_traces, '') + _on_subplot([volume_trace], '2')
+    # Фигура собрана обычными словарями и оборачивается в go.Figure один раз, перед записью
+    # (массивы NumPy plotly сам кодирует в base64 при сериализации)
+    fig_dict = dict(data=data, layout=layout)
+    fig = go.Figure(fig_dict, skip_invalid=True)
+    
     # Сохраняем график
     output_file = "parallel_entry_visualization.html"
-    fig.write_html(output_file)
+    if output_format == 'html':
+        # plotly.js подключается с CDN, а не встраивается (~3 МБ) в каждый файл. Пишем во временный
+        # файл и подменяем им итоговый, чтобы при повторной генерации не остался недописанный HTML
+        tmp_file = output_file + '.tmp'
+        fig.write_html(
+            tmp_file, include_plotlyjs='cdn', include_mathjax=False, full_html=True,
+            validate=False, auto_open=False, config=HTML_CONFIG
+        )
+        os.replace(tmp_file, output_file)
+    else:
+        # Статичная картинка через kaleido: без plotly.js и браузера, файл в десятки КБ
+        output_file = output_file.replace('.html', '.png')
+        fig.write_image(output_file, width=1400, height=layout['height'], scale=1, validate=False)
     print(f"✅ График сохранен: {output_file}")
     print(f"\n📊 Информация:")
     print(f"   Slope 1-3: {slope_1_3:.4f}")